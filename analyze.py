@@ -6,6 +6,7 @@ from pyqtgraph.flowchart import Flowchart, Node
 import pyqtgraph.flowchart.library as fclib
 from pyqtgraph.Qt import QtGui, QtCore
 import pyqtgraph as pg
+import wiimote
 import wiimote_node
 
 
@@ -29,9 +30,11 @@ class LogNode(Node):
         Node.__init__(self, name, terminals=terminals)
 
     def process(self, **kwds):
-        x = str(kwds['accelXIn'][0])
-        y = str(kwds['accelYIn'][0])
-        z = str(kwds['accelZIn'][0])
+        if not len(kwds['accelXIn']):
+            return
+        x = str(kwds['accelXIn'][-1])
+        y = str(kwds['accelYIn'][-1])
+        z = str(kwds['accelZIn'][-1])
         print("X: " + x + " Y: " + y + " Z: " + z)
 
 fclib.registerNodeType(LogNode, [('AccValues',)])
@@ -39,25 +42,32 @@ fclib.registerNodeType(LogNode, [('AccValues',)])
 
 class NormalVectorNode(Node):
     """
-    Creates tuples for x-acceleration and z-acceleration values
-    with the average sensor values subtracted
+    Creates tuples for the latest x-acceleration and z-acceleration values
+    converted to g with the Wiimote's accelerometer calibration
+    (or with a typical calibration if none is connected)
     """
     nodeName = "NormalVector"
-    SIGNAL_AVERAGE = 515
 
     def __init__(self, name):
         terminals = {
             'accelXIn': dict(io='in'),
             'accelZIn': dict(io='in'),
+            'calibration': dict(io='in', optional=True),
             'normalVectorX': dict(io='out'),
             'normalVectorZ': dict(io='out'),
         }
+        self._default_calibration = wiimote.AccelerometerCalibration.default()
+        self._output = None
         Node.__init__(self, name, terminals=terminals)
 
     def process(self, **kargs):
-        zVal = kargs['accelXIn'] - self.SIGNAL_AVERAGE
-        xVal = kargs['accelZIn'] - self.SIGNAL_AVERAGE
-        return {'normalVectorX': (0, xVal), 'normalVectorZ': (0, zVal)}
+        if not len(kargs['accelXIn']):  # no new samples, keep the last vector
+            return self._output
+        calibration = kargs.get('calibration') or self._default_calibration
+        zVal = calibration.to_g(kargs['accelXIn'][-1:], axis=0)
+        xVal = calibration.to_g(kargs['accelZIn'][-1:], axis=2)
+        self._output = {'normalVectorX': (0, xVal), 'normalVectorZ': (0, zVal)}
+        return self._output
 
 fclib.registerNodeType(NormalVectorNode, [('Normal',)])
 
@@ -121,12 +131,13 @@ def createNormalWidget(layout, wiiNode):
     pwN = pg.PlotWidget()
     pwN.setTitle("normal vector")
     layout.addWidget(pwN, 0, 2, 3, 1)
-    pwN.setYRange(-100, 100)
+    pwN.setYRange(-1.5, 1.5)
     pwNNode = fc.createNode('PlotWidget', 'PlotWidgetNormal')
     pwNNode.setPlot(pwN)
     normalNode = fc.createNode('NormalVector', 'NormalVector')
     fc.connectTerminals(wiiNode['accelX'], normalNode['accelXIn'])
     fc.connectTerminals(wiiNode['accelZ'], normalNode['accelZIn'])
+    fc.connectTerminals(wiiNode['calibration'], normalNode['calibration'])
     curve = fc.createNode('PlotCurve', 'PlotCurve')
     fc.connectTerminals(normalNode['normalVectorZ'], curve['x'])
     fc.connectTerminals(normalNode['normalVectorX'], curve['y'])
@@ -33,9 +33,31 @@
 
 # based on the awesome documentation at http://wiibrew.org/wiki/Wiimote
 
-import bluetooth
+import array
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import heapq
+import http.server
+import itertools
+import json
+import mmap
+import os
+import queue
+import select
+import socket
+import struct
 import threading
 import time
+import weakref
+import numpy as np
+try:
+    import bluetooth
+except ImportError:
+    bluetooth = None  # only emulated devices are available
 
 # ################### nanosleep ########################### #
 # from https://github.com/graycatlabs/PyBBIO/blob/master/tests/sleep_test.py
@@ -51,20 +73,13 @@ class Timespec(ctypes.Structure):
 
 libc.nanosleep.argtypes = [ctypes.POINTER(Timespec),
                            ctypes.POINTER(Timespec)]
-nanosleep_req = Timespec()
-nanosleep_rem = Timespec()
 
 
 def nsleep(us):
     """ Delay microseconds with libc nanosleep() using ctypes. """
-    if (us >= 1000000):
-        sec = us/1000000
-        us %= 1000000
-    else:
-        sec = 0
-    nanosleep_req.tv_sec = sec
-    nanosleep_req.tv_nsec = int(us * 1000)
-    libc.nanosleep(nanosleep_req, nanosleep_rem)
+    sec, us = divmod(us, 1000000)
+    # local structs: nsleep() may be called from several threads
+    libc.nanosleep(Timespec(int(sec), int(us * 1000)), None)
 
 # ########################################################### #
 
@@ -73,52 +88,198 @@ DEBUG = False
 KNOWN_DEVICES = ['Nintendo RVL-CNT-01', 'Nintendo RVL-CNT-01-TR']
 
 
-def find():
+def _require_bluetooth():
+    if bluetooth is None:
+        raise RuntimeError("PyBluez is required for talking to real Wiimotes")
+
+
+class DeviceCache(object):
+    """
+    Small on-disk cache of known Wiimotes (btaddr -> model and
+    accelerometer calibration), so that reconnecting to a known controller
+    needs no SDP or name lookup and no calibration read.
+    Models expire `ttl` seconds after the device was last seen.
+    """
+
+    DEFAULT_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                                'wiimote', 'devices.json')
+    DEFAULT_TTL = 30 * 24 * 3600
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        try:
+            with open(path) as f:
+                self._entries = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    def _fresh(self, entry):
+        return time.time() - entry.get('seen', 0) < self.ttl
+
+    def get(self, btaddr):
+        """
+        Returns the cached model of `btaddr` or None.
+        """
+        entry = self._entries.get(btaddr)
+        if entry is not None and self._fresh(entry):
+            return entry.get('model')
+        return None
+
+    def addresses(self):
+        """
+        Returns the addresses of all non-expired entries.
+        """
+        return [btaddr for btaddr, entry in self._entries.items()
+                if 'model' in entry and self._fresh(entry)]
+
+    def put(self, btaddr, model):
+        with self._lock:
+            entry = self._entries.setdefault(btaddr, {})
+            entry.update(model=model, seen=time.time())
+            self._save()
+
+    def get_calibration(self, btaddr):
+        """
+        Returns the cached calibration block of `btaddr` as bytes or None.
+        Calibration data is factory-set, so it does not expire.
+        """
+        calibration = self._entries.get(btaddr, {}).get('calibration')
+        return bytes(calibration) if calibration is not None else None
+
+    def put_calibration(self, btaddr, data):
+        with self._lock:
+            self._entries.setdefault(btaddr, {})['calibration'] = list(data)
+            self._save()
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            _debug("could not write device cache: %s" % e)
+
+
+_device_cache = None
+
+
+def device_cache():
+    """
+    Returns the default DeviceCache.
+    """
+    global _device_cache
+    if _device_cache is None:
+        _device_cache = DeviceCache()
+    return _device_cache
+
+
+def find_iter(duration=5, cache=None, max_workers=8):
+    """
+    Finds available Wiimotes and yields (bt_addr, device_name) tuples as
+    soon as each one has been identified.
+    Previously seen Wiimotes (see DeviceCache) are looked up right away,
+    in parallel with the inquiry for new devices, whose names are then
+    also looked up in parallel.
+    Only supported Wiimote devices are returned.
+    """
+    _require_bluetooth()
+    if cache is None:
+        cache = device_cache()
+    results = queue.Queue()
+    lock = threading.Lock()
+    seen = set()
+    pending = [0]  # outstanding lookups + inquiry
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def lookup(btaddr):
+        try:
+            name = bluetooth.lookup_name(btaddr)
+        except bluetooth.BluetoothError:
+            name = None
+        results.put((btaddr, name))
+
+    def submit(btaddr):
+        with lock:
+            if btaddr in seen:
+                return
+            seen.add(btaddr)
+            pending[0] += 1
+        executor.submit(lookup, btaddr)
+
+    def discover():
+        try:
+            for btaddr in bluetooth.discover_devices(duration=duration, lookup_names=False):
+                submit(btaddr)
+        except bluetooth.BluetoothError as e:
+            _debug("inquiry failed: %s" % e)
+        finally:
+            results.put(None)
+
+    for btaddr in cache.addresses():
+        submit(btaddr)
+    with lock:
+        pending[0] += 1
+    executor.submit(discover)
+    try:
+        while True:
+            with lock:
+                if pending[0] == 0:
+                    break
+            result = results.get()
+            with lock:
+                pending[0] -= 1
+            if result is None:
+                continue
+            btaddr, name = result
+            if name in KNOWN_DEVICES:
+                cache.put(btaddr, name)
+                yield btaddr, name
+    finally:
+        executor.shutdown(wait=False)
+
+
+def find(duration=5):
     """
-    Uses Bluetooth SDP to find available Wiimotes.
+    Finds available Wiimotes.
     Returns a list of (bt_addr, device_name) tuples.
     Only supported Wiimote devices are returned.
+    See find_iter() for getting results while the search is still running.
     """
-    devices = bluetooth.find_service()
-    wiimotes = []
-    for device in devices:
-        if device["name"] in KNOWN_DEVICES:
-            wiimotes.append((device["host"], device["name"]))
-    return wiimotes
+    return list(find_iter(duration))
 
 
-def connect(btaddr, model=None):
+def connect(btaddr, model=None, transport=None, manager=None, cache=None):
     """
     Establishes a connection to the Wiimote at *btaddr* and returns a Wiimote
-    object. If no *model* is specified, the model is determined automatically.
+    object. If no *model* is specified, the model is taken from the device
+    cache or determined automatically. The accelerometer calibration is
+    also taken from the cache or read from the device in the background.
+    If no *transport* is given, a BluetoothTransport is used.
+    If a WiimoteManager is given as *manager*, its receive threads service
+    the connection instead of a dedicated thread.
     """
+    if cache is None:
+        cache = device_cache()
+    if model is None:
+        model = cache.get(btaddr)
     if model is None:
+        _require_bluetooth()
         model = bluetooth.lookup_name(btaddr)
     if model in KNOWN_DEVICES:
-        return WiiMote(btaddr, model)
+        # only Bluetooth devices are cached, not emulated or replayed ones
+        wm = WiiMote(btaddr, model, transport, manager, cache if transport is None else None)
+        if transport is None:
+            cache.put(btaddr, model)
+        return wm
     else:
         raise Exception("Wiimote model '%s' unknown!" % (model))
 
 
-def _val_to_byte_list(number, num_bytes, big_endian=True):
-    """
-    Converts an integer into a big/little-endian multi-byte representation.
-    Similar to int.to_bytes() in the standard lib but returns a list of integers
-    between 0 and 255 (which allows for bitwise arithmetic) instead of a bytearray.
-    Example: _val_to_byte_list(513, 2, True) -> [0x02, 0x01]
-    """
-    if number > (2**(8*num_bytes))-1:
-        raise ValueError("Unsigned integer %d does not fit into %d bytes!" % (number, num_bytes))
-    byte_list = []
-    for b in range(num_bytes):
-        val = (number >> (8*b)) & 0xff
-        if big_endian:
-            byte_list.insert(0, val)
-        else:
-            byte_list.append(val)
-    return byte_list
-
-
 def _flatten(list_of_lists):
     """
     Turns a nested list of lists ([a,[b,c]]) into a flat list ([a,b,c]).
@@ -134,15 +295,6 @@ def _flatten(list_of_lists):
     return out
 
 
-def _add_padding(byte_list, intended_length, padding_byte=0x00):
-    """
-    Pads a list with 0x00's or other padding bytes so that it reaches the intended length.
-    """
-    for _ in range(intended_length - len(byte_list)):
-        byte_list.append(padding_byte)
-    return byte_list
-
-
 def _debug(msg):
     """
     Internal debugging function, prints out parameters on stdout
@@ -152,18 +304,499 @@ def _debug(msg):
         print("DEBUG: " + str(msg))
 
 
+class SampleBuffer(object):
+    """
+    Fixed-capacity, array-backed ring buffer of timestamped sensor samples.
+    Every sample gets a monotonic receive timestamp and a sequence number
+    (the number of samples written before it).
+    The buffer is written by a single thread (the CommunicationHandler) and
+    read by any number of SampleReader objects (see reader()).
+    Each sample is stored twice (at index i and i + capacity) so that any
+    window of up to `capacity` samples is one contiguous slice, which allows
+    readers to get NumPy views instead of copies.
+    """
+
+    def __init__(self, shape, capacity=4096, dtype=np.uint16):
+        if isinstance(shape, int):
+            shape = (shape,)
+        self.capacity = capacity
+        self._data = np.zeros((2 * capacity,) + tuple(shape), dtype=dtype)
+        self._times = np.zeros(2 * capacity, dtype=np.float64)
+        self._seq = 0  # sequence number of the next sample
+        self._write_count = 0  # seqlock: odd while a write is in progress
+
+    def __len__(self):
+        return min(self._seq, self.capacity)
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def append(self, sample, timestamp=None):
+        """
+        Append one sample. Does not allocate.
+        If no `timestamp` is given, time.monotonic() is used.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        idx = self._seq % self.capacity
+        self._write_count += 1
+        self._data[idx] = sample
+        self._data[idx + self.capacity] = sample
+        self._times[idx] = timestamp
+        self._times[idx + self.capacity] = timestamp
+        self._seq += 1
+        self._write_count += 1
+
+    def extend(self, samples, timestamps=None):
+        """
+        Append many samples at once.
+        `timestamps` may be a single value for all samples or one per sample.
+        If more than `capacity` samples are given, only the last `capacity`
+        are stored (but all of them are counted in the sequence number).
+        """
+        samples = np.asarray(samples)
+        if timestamps is None:
+            timestamps = time.monotonic()
+        timestamps = np.broadcast_to(timestamps, (len(samples),))
+        skipped = max(len(samples) - self.capacity, 0)
+        samples = samples[skipped:]
+        timestamps = timestamps[skipped:]
+        n = len(samples)
+        start = (self._seq + skipped) % self.capacity
+        first = min(n, self.capacity - start)  # samples before wrapping around
+        self._write_count += 1
+        for offset in (0, self.capacity):
+            self._data[start + offset:start + offset + first] = samples[:first]
+            self._data[offset:offset + n - first] = samples[first:]
+            self._times[start + offset:start + offset + first] = timestamps[:first]
+            self._times[offset:offset + n - first] = timestamps[first:]
+        self._seq += skipped + n
+        self._write_count += 1
+
+    def window(self, start_seq, end_seq):
+        """
+        Returns views (timestamps, samples) for the samples with sequence
+        numbers `start_seq` to `end_seq` - 1.
+        The range must not be longer than the capacity.
+        """
+        start = start_seq % self.capacity
+        end = start + (end_seq - start_seq)
+        return self._times[start:end], self._data[start:end]
+
+    def snapshot(self, since_seq=0):
+        """
+        Returns (first_seq, end_seq) of a consistent range of samples that
+        starts at `since_seq` or at the oldest sample still in the buffer.
+        Uses a seqlock, so the writer never has to wait for readers.
+        """
+        while True:
+            count = self._write_count
+            if count & 1:  # writer is busy, try again
+                time.sleep(0)
+                continue
+            end_seq = self._seq
+            first_seq = max(since_seq, end_seq - self.capacity)
+            if self._write_count == count:
+                return first_seq, end_seq
+
+    def latest(self, n=1):
+        """
+        Returns views (timestamps, samples) of the last `n` samples.
+        """
+        first_seq, end_seq = self.snapshot(self._seq - n)
+        return self.window(max(first_seq, 0), end_seq)
+
+    def reader(self):
+        """
+        Returns a new SampleReader that starts at the current end of the buffer.
+        """
+        return SampleReader(self)
+
+
+class SampleReader(object):
+    """
+    Reads all samples from a SampleBuffer that arrived since the last read().
+    """
+
+    def __init__(self, sample_buffer):
+        self._buffer = sample_buffer
+        self._next_seq = sample_buffer.seq
+        self.lost = 0  # samples overwritten before they could be read
+
+    def available(self):
+        return self._buffer.seq - self._next_seq
+
+    def read(self):
+        """
+        Returns zero-copy views (timestamps, samples) of everything that
+        arrived since the previous call.
+        The views stay valid until the writer has appended another
+        `capacity - len(samples)` samples; copy them if you need them longer.
+        """
+        first_seq, end_seq = self._buffer.snapshot(self._next_seq)
+        self.lost += first_seq - self._next_seq
+        self._next_seq = end_seq
+        return self._buffer.window(first_seq, end_seq)
+
+
+def _add_reader(readers, reader, com):
+    """
+    Adds `reader` to the WeakSet `readers` of a sensor, which is active
+    while it has readers, and updates the report dispatch (and thus the
+    reporting mode) now and once the reader has been garbage collected.
+    """
+    readers.add(reader)
+    weakref.finalize(reader, com.update_dispatch).atexit = False
+    com.update_dispatch()
+
+
+def _has_readers(readers):
+    # iterating skips readers that are already dead but not yet removed
+    return any(True for _ in readers)
+
+
+# ################### asyncio bridge ###################### #
+
+class _LoopSignal(object):
+    """
+    Wakes up a task on an asyncio event loop from the CommunicationHandler
+    thread. While a wake-up is pending, further calls to set_threadsafe()
+    are free, so the loop is woken at most once per batch of reports.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._pending = False
+
+    def set_threadsafe(self, *args):
+        if self._pending:
+            return
+        self._pending = True
+        try:
+            self._loop.call_soon_threadsafe(self._set)
+        except RuntimeError:  # event loop has been closed
+            pass
+
+    def _set(self):
+        self._pending = False
+        self._event.set()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+async def _stream_samples(sensor, max_batch, interval):
+    """
+    Async generator behind Accelerometer.stream() and IRCam.stream().
+    """
+    signal = _LoopSignal(asyncio.get_running_loop())
+    reader = sensor.reader()
+    sensor.register_callback(signal.set_threadsafe, Subscription.INLINE)
+    try:
+        while True:
+            await signal.wait()
+            if interval > 0:  # let more samples accumulate
+                await asyncio.sleep(interval)
+            timestamps, samples = reader.read()
+            # copy at once: the ring buffer may wrap while the consumer awaits
+            timestamps, samples = timestamps.copy(), samples.copy()
+            for start in range(0, len(samples), max_batch):
+                yield timestamps[start:start + max_batch], samples[start:start + max_batch]
+    finally:
+        reader = None  # release the reader first, so the sensor can become inactive
+        sensor.unregister_callback(signal.set_threadsafe)
+
+
+# ################### callback dispatch ###################### #
+
+class Subscription(object):
+    """
+    A registered callback together with its delivery policy.
+
+    Except for INLINE subscriptions, every subscription has its own bounded
+    queue and delivery thread, so a slow callback never delays report
+    reception or other subscribers. When the queue is full:
+
+    BLOCK        the receive thread waits for the callback (lossless,
+                 but slows down reception for everyone)
+    DROP_OLDEST  the oldest queued item is discarded
+    COALESCE     only the latest item is kept, intermediate items are skipped
+    BATCH        like DROP_OLDEST, but the callback gets a list of all
+                 items queued since its last call
+    INLINE       the callback is called directly on the receive thread;
+                 only for callbacks that return immediately
+    """
+
+    INLINE = 'inline'
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    COALESCE = 'coalesce'
+    BATCH = 'batch'
+
+    POLICIES = (INLINE, BLOCK, DROP_OLDEST, COALESCE, BATCH)
+
+    def __init__(self, func, policy=DROP_OLDEST, maxsize=256, timing=False):
+        if policy not in Subscription.POLICIES:
+            raise ValueError("unknown dispatch policy '%s'" % policy)
+        self.func = func
+        self.policy = policy
+        self.maxsize = 1 if policy == Subscription.COALESCE else max(maxsize, 1)
+        self.delivered = 0
+        self.dropped = 0
+        self.max_pending = 0
+        self.timing = timing  # record latency and duration
+        self.latency = Histogram(Histogram.DURATION_BOUNDS)  # report received -> callback called
+        self.duration = Histogram(Histogram.DURATION_BOUNDS)  # time spent in the callback
+        self.running = True
+        # except for BLOCK, a full deque discards its oldest item on append
+        self._queue = collections.deque(maxlen=None if policy == Subscription.BLOCK else self.maxsize)
+        self._cond = threading.Condition()
+        self._idle = False
+        self._thread = None
+        if policy != Subscription.INLINE:
+            self._thread = threading.Thread(target=self._run, name="callback %r" % (func,))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def put(self, item, timestamp=None):
+        """
+        Hands `item` to the callback according to the policy.
+        `timestamp` is the time.monotonic() receive time of the report,
+        used for latency statistics.
+        """
+        if self._thread is None:
+            self.func(item)
+            self.delivered += 1
+            return
+        queue = self._queue
+        pending = len(queue)
+        if pending > self.max_pending:
+            self.max_pending = pending
+        if pending >= self.maxsize:
+            if self.policy == Subscription.BLOCK:
+                with self._cond:
+                    while len(queue) >= self.maxsize and self.running:
+                        self._cond.wait()
+            else:
+                self.dropped += 1
+        queue.append((item, timestamp))  # deque operations are atomic
+        if self._idle:  # only wake up the delivery thread if it is waiting
+            with self._cond:
+                self._idle = False
+                self._cond.notify_all()
+
+    def pending(self):
+        return len(self._queue)
+
+    def close(self):
+        """
+        Stops delivery; queued items are discarded.
+        """
+        with self._cond:
+            self.running = False
+            self._queue.clear()
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(1.0)
+
+    def _run(self):
+        queue = self._queue
+        batch = self.policy == Subscription.BATCH
+        block = self.policy == Subscription.BLOCK
+        while True:
+            if not queue:
+                with self._cond:
+                    self._idle = True
+                    while not queue and self.running:
+                        self._cond.wait()
+                    self._idle = False
+            if not self.running:
+                return
+            if batch:
+                entries = [queue.popleft() for _ in range(len(queue))]
+                item = [entry[0] for entry in entries]
+                timestamp = entries[0][1]
+            else:
+                item, timestamp = queue.popleft()
+            if block:  # wake up the waiting producer
+                with self._cond:
+                    self._cond.notify_all()
+            if self.timing:
+                start = time.monotonic()
+                if timestamp is not None:
+                    self.latency.add((start - timestamp) * 1e6)
+            try:
+                self.func(item)
+            except Exception as e:
+                _debug("callback %r failed: %r" % (self.func, e))
+            if self.timing:
+                self.duration.add((time.monotonic() - start) * 1e6)
+            self.delivered += len(item) if batch else 1
+
+    def stats(self):
+        """
+        Returns delivery statistics as a dict; times are in microseconds.
+        """
+        return {'callback': getattr(self.func, '__qualname__', repr(self.func)),
+                'policy': self.policy,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'pending': len(self._queue),
+                'max_pending': self.max_pending,
+                'latency_us': self.latency.summary(),
+                'duration_us': self.duration.summary()}
+
+
+def _unpacking(func):
+    """
+    Wraps `func(*args)` as a Subscription callback that gets `args` as one item.
+    """
+    @functools.wraps(func)
+    def call(args):
+        return func(*args)
+    return call
+
+
+class _CallbackList(object):
+    """
+    The subscriptions of one event source. notify() iterates over an
+    immutable snapshot, so callbacks may be (un)registered at any time,
+    even from within a callback.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = ()
+        self.timing = False
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def __iter__(self):
+        return iter(self._subscriptions)
+
+    def add(self, func, policy, maxsize):
+        subscription = Subscription(func, policy, maxsize, self.timing)
+        with self._lock:
+            self._subscriptions += (subscription,)
+        return subscription
+
+    def remove(self, func):
+        """
+        Removes and closes the subscriptions of `func`. Returns False if
+        `func` was not registered.
+        """
+        with self._lock:
+            removed = [sub for sub in self._subscriptions if sub.func == func]
+            self._subscriptions = tuple(sub for sub in self._subscriptions if sub.func != func)
+        for subscription in removed:
+            subscription.close()
+        return bool(removed)
+
+    def close(self):
+        """
+        Removes and closes all subscriptions.
+        """
+        with self._lock:
+            removed, self._subscriptions = self._subscriptions, ()
+        for subscription in removed:
+            subscription.close()
+
+    def notify(self, item, timestamp=None):
+        for subscription in self._subscriptions:
+            subscription.put(item, timestamp)
+
+    def set_timing(self, enabled):
+        self.timing = enabled
+        for subscription in self._subscriptions:
+            subscription.timing = enabled
+
+# ########################################################### #
+
+
+class AccelerometerCalibration(object):
+    """
+    Zero point and 1 g point of the three accelerometer axes in raw
+    (10 bit) counts, as stored in the Wiimote's EEPROM at ADDRESS, with a
+    copy at BACKUP_ADDRESS.
+    """
+
+    ADDRESS = 0x16
+    BACKUP_ADDRESS = 0x20
+    SIZE = 10  # zero point, 1 g point, unused byte, checksum
+
+    def __init__(self, zero, one_g):
+        self.zero = np.array(zero, dtype=np.float64)
+        self.one_g = np.array(one_g, dtype=np.float64)
+        self.scale = 1.0 / (self.one_g - self.zero)  # g per count
+
+    def __repr__(self):
+        return "AccelerometerCalibration(zero=%s, one_g=%s)" % (self.zero.tolist(), self.one_g.tolist())
+
+    @classmethod
+    def default(cls):
+        """
+        Returns a typical calibration (zero point 512, 1 g at 616 counts)
+        for use until the device's own calibration has been read.
+        """
+        return cls((0x80 << 2,) * 3, (0x9a << 2,) * 3)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Parses a calibration block; raises a ValueError if its checksum is wrong.
+        """
+        data = bytes(data)
+        if len(data) < cls.SIZE or (sum(data[:9]) + 0x55) & 0xff != data[9]:
+            raise ValueError("invalid accelerometer calibration %s" % data.hex())
+
+        def point(offset):
+            low_bits = data[offset + 3]
+            return ((data[offset] << 2) | (low_bits >> 4) & 0x03,
+                    (data[offset + 1] << 2) | (low_bits >> 2) & 0x03,
+                    (data[offset + 2] << 2) | low_bits & 0x03)
+        return cls(point(0), point(4))
+
+    def to_g(self, samples, axis=None, out=None):
+        """
+        Converts raw samples to g. `samples` is an array of shape (..., 3),
+        e.g. from SampleReader.read(), or, if an `axis` (0-2) is given, an
+        array of values of that axis only. The result is a new float64 array
+        unless `out` is given.
+        """
+        if axis is None:
+            zero, scale = self.zero, self.scale
+        else:
+            zero, scale = self.zero[axis], self.scale[axis]
+        out = np.subtract(samples, zero, out=out)
+        return np.multiply(out, scale, out=out)
+
+
 class Accelerometer(object):
     """
     Represents the accelerometer of the Wiimote.
+    Values are raw counts between 0 and 1023; use to_g() to convert them
+    with the device's calibration.
     """
 
-    SUPPORTED_REPORTS = [0x31, 0x33]
+    SUPPORTED_REPORTS = [0x31, 0x33, 0x35, 0x37, 0x3e, 0x3f]
+
+    BUFFER_SIZE = 8192  # about 80 seconds at 100 Hz
 
     def __init__(self, wiimote):
         self._state = [0.0, 0.0, 0.0]
         self._wiimote = wiimote
         self._com = wiimote._com
-        self._callbacks = []
+        self._callbacks = _CallbackList()
+        self._readers = weakref.WeakSet()
+        self._enabled = True
+        self._interleaved = None  # (x, z bits) from the last 0x3e report
+        self.samples = SampleBuffer(3, capacity=Accelerometer.BUFFER_SIZE, dtype=np.uint16)
+        self.calibration = AccelerometerCalibration.default()
+        self._calibration_future = None
 
     def __len__(self):
         return len(self._state)
@@ -177,48 +810,177 @@ class Accelerometer(object):
         else:
             raise IndexError("list index %d out of range" % (axis))
 
-    def register_callback(self, func):
+    def reader(self):
+        """
+        Returns a SampleReader for lossless access to all accelerometer
+        samples. Each call to its read() returns (timestamps, samples) views
+        with all samples received since the previous call.
+        """
+        reader = self.samples.reader()
+        _add_reader(self._readers, reader, self._com)
+        return reader
+
+    def stream(self, max_batch=64, interval=0.0):
+        """
+        Async generator for use with asyncio:
+            async for timestamps, samples in wm.accelerometer.stream():
+        Yields arrays of up to `max_batch` samples (shape (n, 3)) with
+        their receive timestamps. No sample is skipped unless the consumer
+        falls more than BUFFER_SIZE samples behind.
+        With an `interval` > 0 the consumer is woken at most once per
+        `interval` seconds, which yields larger batches.
+        """
+        return _stream_samples(self, max_batch, interval)
+
+    def load_calibration(self, cache=None, timeout=None):
+        """
+        Reads the calibration block from the EEPROM (or the backup copy if
+        its checksum is wrong or reading it failed) without blocking. If a
+        DeviceCache is given, a cached calibration is used instead, and a
+        calibration read from the device is stored in it.
+        Each read fails after `timeout` seconds (default: Memory.READ_TIMEOUT).
+        Returns a concurrent.futures.Future that resolves to the new
+        calibration; `calibration` keeps its previous values (the defaults
+        after connecting) until then and if reading fails.
+        """
+        future = self._calibration_future = concurrent.futures.Future()
+        btaddr = self._wiimote.btaddr
+        data = cache.get_calibration(btaddr) if cache is not None else None
+        if data is not None:
+            try:
+                self.calibration = AccelerometerCalibration.from_bytes(data)
+                future.set_result(self.calibration)
+                return future
+            except ValueError:
+                pass
+        memory = self._wiimote.memory
+        if timeout is None:
+            timeout = Memory.READ_TIMEOUT
+        addresses = [AccelerometerCalibration.ADDRESS, AccelerometerCalibration.BACKUP_ADDRESS]
+
+        def read_next():
+            address = addresses.pop(0)
+            memory.read_async(address, AccelerometerCalibration.SIZE, eeprom=True,
+                              timeout=timeout).add_done_callback(done)
+
+        def done(read):
+            try:
+                data = read.result()
+                calibration = AccelerometerCalibration.from_bytes(data)
+            except (RuntimeError, ValueError, concurrent.futures.TimeoutError) as e:
+                _debug("could not read accelerometer calibration: %s" % e)
+                if addresses:
+                    read_next()
+                else:
+                    future.set_exception(e)
+                return
+            self.calibration = calibration
+            if cache is not None:
+                cache.put_calibration(btaddr, data)
+            future.set_result(calibration)
+        read_next()
+        return future
+
+    def wait_calibration(self, timeout=None):
+        """
+        Waits until the calibration started by load_calibration() has been
+        read and returns `calibration`, which keeps its previous values if
+        reading failed.
+        """
+        if self._calibration_future is not None:
+            concurrent.futures.wait([self._calibration_future], timeout)
+        return self.calibration
+
+    def to_g(self, samples, axis=None, out=None):
+        """
+        Converts raw samples (an array of shape (..., 3) or the values of
+        one `axis`) to g with the device's calibration, see
+        AccelerometerCalibration.to_g().
+        """
+        return self.calibration.to_g(samples, axis, out)
+
+    def set_enabled(self, enabled):
+        """
+        Accelerometer reports are decoded while the accelerometer is enabled
+        (the default) or has callbacks or readers. Disable it if nobody
+        polls its state to save CPU time.
+        """
+        self._enabled = enabled
+        self._com.update_dispatch()
+
+    def is_active(self):
+        return self._enabled or bool(self._callbacks) or _has_readers(self._readers)
+
+    def register_callback(self, func, policy=Subscription.DROP_OLDEST, maxsize=256):
         """
         Register a callback function `func` that gets called every time
         when new accelerometer values are transmitted from the Wiimote.
         A list with XYZ accelerometer values between 0 and 1023 is passed
         to the callback function.
+        The callback runs on its own thread; `policy` and `maxsize`
+        determine what happens if it can not keep up (see Subscription).
+        Returns the Subscription.
         """
-        self._callbacks.append(func)
+        subscription = self._callbacks.add(func, policy, maxsize)
+        self._com.update_dispatch()
+        return subscription
 
     def unregister_callback(self, func):
         """
         Unregister a callback function `func` that has been previously registered.
         The function will no longer get called on new accelerometer data from the Wiimote.
         """
-        if func in self._callbacks:
-            self._callbacks.remove(func)
+        if self._callbacks.remove(func):
+            self._com.update_dispatch()
 
-    def _notify_callbacks(self):
+    def _notify_callbacks(self, timestamp=None):
         """
         Call all registered callback functions with state (x,y,z values) as parameter.
         """
-        for callback in self._callbacks:
-            callback(self._state)
+        self._callbacks.notify(self._state, timestamp)
 
-    def handle_report(self, report):
+    def handle_report(self, report, timestamp=None):
         """
         Extract accelerometer data from a Wiimote report.
         Usually gets called by the Wiimote CommunicationHandler object.
         """
-        if report[0] in [0x3e, 0x3f]:  # interleaved modes
-            raise NotImplementedError("Data reporting mode 0x3e/0x3f not supported")
-        x_msb, y_msb, z_msb = report[3:6]
-        x = (x_msb << 2) + ((report[1] & 0b01100000) >> 5)
-        y = (y_msb << 2) + ((report[2] & 0b00100000) >> 4)
-        z = (z_msb << 2) + ((report[2] & 0b01000000) >> 5)
+        rpt = report[0]
+        if rpt >= 0x3e:
+            # interleaved mode: 8 bit values, X in 0x3e, Y in 0x3f and
+            # the bits of Z in bits 5 and 6 of the button bytes of both
+            z_bits = ((report[1] & 0b01100000) >> 5) | ((report[2] & 0b01100000) >> 3)
+            if rpt == 0x3e:
+                self._interleaved = (report[3] << 2, z_bits << 4)
+                return
+            if self._interleaved is None:  # first half got lost
+                return
+            x, z_high = self._interleaved
+            self._interleaved = None
+            y = report[3] << 2
+            z = (z_high | z_bits) << 2
+        else:
+            x_msb, y_msb, z_msb = report[3:6]
+            x = (x_msb << 2) + ((report[1] & 0b01100000) >> 5)
+            y = (y_msb << 2) + ((report[2] & 0b00100000) >> 4)
+            z = (z_msb << 2) + ((report[2] & 0b01000000) >> 5)
         self._state = [x, y, z]
-        self._notify_callbacks()
+        self.samples.append(self._state, timestamp)
+        if self._callbacks:
+            self._notify_callbacks(timestamp)
+
+
+ButtonEvent = collections.namedtuple('ButtonEvent', ['button', 'pressed', 'timestamp', 'duration'])
+ButtonEvent.__doc__ = """
+A button press or release.
+`duration` is the time the button has been held down (for releases) or 0.0.
+"""
 
 
 class Buttons(object):
     """
     Represents the buttons of the Wiimote.
+    The state is kept as a bitmask (see BUTTONS); reports that do not change
+    any button cost a single XOR.
     """
 
     BUTTONS = {'A': 0x0008,
@@ -233,85 +995,458 @@ class Buttons(object):
                'Two': 0x0001,
                'Up': 0x0800, }
 
-    def __init__(self, wiimote):
+    MASK = sum(BUTTONS.values())
+    NAMES = dict((mask, name) for name, mask in BUTTONS.items())
+
+    # all input reports except 0x3d carry the core buttons
+    SUPPORTED_REPORTS = [0x20, 0x21, 0x22] + list(range(0x30, 0x3d)) + [0x3e, 0x3f]
+
+    def __init__(self, wiimote, debounce=0.0):
         self._wiimote = wiimote
         self._com = wiimote._com
-        self._state = {}
-        for button in list(Buttons.BUTTONS.keys()):
-            self._state[button] = False
-        self._callbacks = []
+        self._mask = 0
+        self._callbacks = _CallbackList()
+        self._event_callbacks = _CallbackList()
+        self.debounce = debounce  # min. time between two edges of the same button
+        self._last_edge = dict((mask, float('-inf')) for mask in Buttons.NAMES)
+        self._pressed_at = dict((mask, 0.0) for mask in Buttons.NAMES)
+        self._chords = []  # [mask, subscription, active, names]
+        self._sequences = []  # (masks, subscription, timeout, press history, names)
+        self._gesture_callbacks = _CallbackList()  # subscriptions of chords and sequences
 
     def __len__(self):
-        return len(self._state)
+        return len(Buttons.BUTTONS)
 
     def __repr__(self):
-        return repr(self._state)
+        return repr(self.get_state())
 
     def __getitem__(self, btn):
-        if btn in self._state:
-            return self._state[btn]
+        if btn in Buttons.BUTTONS:
+            return bool(self._mask & Buttons.BUTTONS[btn])
         else:
             raise KeyError(str(btn))
 
-    def register_callback(self, func):
+    @property
+    def mask(self):
+        """ bitmask of all currently pressed buttons """
+        return self._mask
+
+    def get_state(self):
+        """
+        Returns a dict with the state (True = pressed) of every button.
+        """
+        return dict((btn, bool(self._mask & mask)) for btn, mask in Buttons.BUTTONS.items())
+
+    def held_duration(self, btn, now=None):
+        """
+        Returns for how many seconds button `btn` has been held down (0.0 if released).
+        """
+        mask = Buttons.BUTTONS[btn]
+        if not self._mask & mask:
+            return 0.0
+        if now is None:
+            now = time.monotonic()
+        return now - self._pressed_at[mask]
+
+    def register_callback(self, func, policy=Subscription.BLOCK, maxsize=256):
         """
         Register a callback function `func` that gets called every time
-        when new button states are transmitted from the Wiimote.
+        when button states change.
         A list of all _changed_ buttons is passed as parameter to this function.
+        The callback runs on its own thread, see Accelerometer.register_callback().
+        Button changes are not dropped by default.
         """
-        self._callbacks.append(func)
+        return self._callbacks.add(func, policy, maxsize)
 
     def unregister_callback(self, func):
         """
         Unregister a callback function `func` that has been previously registered.
         The function will no longer get called on changed button states.
         """
-        if func in self._callbacks:
-            self._callbacks.remove(func)
+        self._callbacks.remove(func)
+
+    def register_event_callback(self, func, policy=Subscription.BLOCK, maxsize=256):
+        """
+        Register a callback function `func` that gets called with a
+        ButtonEvent for every press and every release.
+        """
+        return self._event_callbacks.add(func, policy, maxsize)
+
+    def unregister_event_callback(self, func):
+        self._event_callbacks.remove(func)
+
+    async def events(self):
+        """
+        Async generator yielding a ButtonEvent for every press and release:
+            async for event in wm.buttons.events():
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def put(event):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:  # event loop has been closed
+                pass
+        self.register_event_callback(put, Subscription.INLINE)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.unregister_event_callback(put)
+
+    async def wait_for(self, button=None, pressed=True):
+        """
+        Waits for the next press (or release, with pressed=False) of `button`
+        (or of any button) and returns the ButtonEvent.
+        """
+        events = self.events()
+        try:
+            async for event in events:
+                if (button is None or event.button == button) and event.pressed == pressed:
+                    return event
+        finally:
+            await events.aclose()
 
-    def _notify_callbacks(self, diff):
+    def add_chord(self, buttons, func, policy=Subscription.BLOCK, maxsize=256):
+        """
+        Call `func(buttons, timestamp)` whenever all `buttons` (a list of
+        button names) become pressed at the same time.
+        Like other callbacks, `func` runs on its own thread, see
+        register_callback(). Returns the Subscription.
+        """
+        mask = sum(Buttons.BUTTONS[btn] for btn in buttons)
+        subscription = self._gesture_callbacks.add(_unpacking(func), policy, maxsize)
+        self._chords.append([mask, subscription, False, list(buttons)])
+        return subscription
+
+    def add_sequence(self, buttons, func, timeout=1.0, policy=Subscription.BLOCK, maxsize=256):
+        """
+        Call `func(buttons, timestamp)` whenever `buttons` (a list of button
+        names) are pressed one after another, with at most `timeout`
+        seconds between two presses.
+        Like other callbacks, `func` runs on its own thread, see
+        register_callback(). Returns the Subscription.
+        """
+        masks = [Buttons.BUTTONS[btn] for btn in buttons]
+        history = collections.deque(maxlen=len(masks))  # (mask, timestamp) of recent presses
+        subscription = self._gesture_callbacks.add(_unpacking(func), policy, maxsize)
+        self._sequences.append((masks, subscription, timeout, history, list(buttons)))
+        return subscription
+
+    def is_active(self):
+        return True  # keeps the button state up to date for polling
+
+    def _notify_callbacks(self, diff, timestamp=None):
         """
         Call all registered callback functions with a list of buttons whose state
         has changed as parameter.
         """
-        for callback in self._callbacks:
-            callback(diff)
+        self._callbacks.notify(diff, timestamp)
 
-    def handle_report(self, report):
+    def handle_report(self, report, timestamp=None):
         """
         Extract button data from a Wiimote report.
         Usually gets called by the Wiimote CommunicationHandler object.
         """
-        btn_bytes = (report[1] << 8) + report[2]
-        new_state = {}
-        for btn, mask in list(Buttons.BUTTONS.items()):
-            new_state[btn] = bool(mask & btn_bytes)
-        diff = self._update_state(new_state)
-        self._notify_callbacks(diff)
+        changed = (((report[1] << 8) | report[2]) & Buttons.MASK) ^ self._mask
+        if not changed:
+            return
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self._update_state(changed, timestamp)
 
-    def _update_state(self, new_state):
+    def _update_state(self, changed, timestamp):
         diff = []
-        for btn, state in list(new_state.items()):
-            if self._state[btn] != state:
-                diff.append((btn, state))
-                self._state[btn] = state
-        return diff
+        events = []
+        pressed_now = 0
+        while changed:
+            bit = changed & -changed  # lowest changed bit
+            changed ^= bit
+            if timestamp - self._last_edge[bit] < self.debounce:
+                continue  # bouncing: keep the old state for this button
+            self._last_edge[bit] = timestamp
+            self._mask ^= bit
+            pressed = bool(self._mask & bit)
+            name = Buttons.NAMES[bit]
+            if pressed:
+                self._pressed_at[bit] = timestamp
+                pressed_now |= bit
+                duration = 0.0
+            else:
+                duration = timestamp - self._pressed_at[bit]
+            diff.append((name, pressed))
+            events.append(ButtonEvent(name, pressed, timestamp, duration))
+        if not diff:
+            return
+        self._notify_callbacks(diff, timestamp)
+        if self._event_callbacks:
+            for event in events:
+                self._event_callbacks.notify(event, timestamp)
+        if self._chords:
+            self._check_chords(timestamp)
+        if pressed_now and self._sequences:
+            self._check_sequences(pressed_now, timestamp)
 
+    def _check_chords(self, timestamp):
+        for chord in self._chords:
+            active = self._mask & chord[0] == chord[0]
+            if active and not chord[2]:
+                chord[1].put((chord[3], timestamp), timestamp)
+            chord[2] = active
 
-class LEDs(object):
+    def _check_sequences(self, pressed_now, timestamp):
+        for masks, subscription, timeout, history, names in self._sequences:
+            bit = pressed_now
+            while bit:
+                lowest = bit & -bit
+                bit ^= lowest
+                if history and timestamp - history[-1][1] > timeout:
+                    history.clear()
+                history.append((lowest, timestamp))
+                if len(history) == len(masks) and \
+                   all(mask == entry[0] for mask, entry in zip(masks, history)):
+                    history.clear()
+                    subscription.put((names, timestamp), timestamp)
+
+
+# ################### actuators ########################## #
+
+class ActuatorTimeline(object):
     """
-    Represents the LEDs of the Wiimote.
+    A timed sequence of LED and rumble states, see ActuatorScheduler.play().
+    Each step is a (duration, value, mask) tuple: for `duration` seconds,
+    the state bits in `mask` are set to those in `value` (LEDs: 0x10-0x80,
+    rumble: 0x01). A `repeat` count of 0 repeats the steps until cancel().
+    A timeline can be played again once it is done; playing it while it
+    runs restarts it.
     """
 
-    def __init__(self, wiimote):
-        self._state = [False, False, False, False]
-        self._com = wiimote._com
+    def __init__(self, steps, repeat=1, priority=0):
+        self.steps = [(float(duration), value, mask) for duration, value, mask in steps]
+        if not self.steps:
+            raise ValueError("timeline needs at least one step")
+        if any(duration < 0 for duration, _, _ in self.steps):
+            raise ValueError("step durations need to be at least 0 seconds")
+        if sum(duration for duration, _, _ in self.steps) <= 0:
+            raise ValueError("timeline needs to last longer than 0 seconds")
+        if repeat < 0:
+            raise ValueError("repeat count needs to be 0 (forever) or greater")
+        self.repeat = repeat
+        self.priority = priority
+        self._index = 0
+        self._remaining = repeat  # repetitions left in the current run
+        self._run = 0  # incremented by every play(), invalidates steps of earlier runs
+        self._done = threading.Event()
+        self._scheduler = None
+        self._channel = None
+        self.cancelled = False
 
-    def __len__(self):
-        return len(self._state)
+    def cancel(self):
+        """
+        Stops the timeline; the actuators return to the state given by
+        other timelines or set directly.
+        """
+        self.cancelled = True
+        self._done.set()
+        if self._scheduler is not None:
+            self._scheduler._cancelled(self)
 
-    def __repr__(self):
-        return repr(self._state)
+    def is_done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits until the timeline has finished or has been cancelled.
+        """
+        return self._done.wait(timeout)
+
+
+class _ActuatorChannel(object):
+    """
+    Actuator state of one device within an ActuatorScheduler.
+    """
+
+    def __init__(self, com):
+        self.com = com
+        self.base = 0x00  # state set directly with set_leds()/set_rumble()
+        self.timelines = []  # active timelines, in start order
+        self.sent = None  # last state sent to the device
+
+
+class ActuatorScheduler(threading.Thread):
+    """
+    Runs the LED and rumble timelines of one or more Wiimotes in a single
+    thread. Whenever timelines advance or states are set, the resulting
+    state of each device is computed: timelines with a higher priority
+    (or, for equal priorities, started later) override lower ones for the
+    bits they control, and the directly set state applies where no
+    timeline does. All changes due within TICK seconds are merged into at
+    most one output report per device, and nothing is sent if the state
+    did not change.
+    """
+
+    TICK = 0.005
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="ActuatorScheduler")
+        self.daemon = True
+        self.running = False
+        self.reports_sent = 0
+        self._thread_started = False
+        self._cond = threading.Condition()
+        self._channels = {}  # CommunicationHandler -> _ActuatorChannel
+        self._heap = []  # (time of next step, sequence number, channel, timeline, run)
+        self._sequence = itertools.count()
+        self._dirty = set()
+
+    def _channel(self, com):
+        channel = self._channels.get(com)
+        if channel is None:
+            channel = self._channels[com] = _ActuatorChannel(com)
+        if not self._thread_started:  # only start a thread for devices that use their actuators
+            self._thread_started = self.running = True
+            self.start()
+        return channel
+
+    def set_state(self, com, value, mask):
+        """
+        Sets the bits in `mask` of the directly controlled state of device `com`.
+        """
+        with self._cond:
+            channel = self._channel(com)
+            channel.base = (channel.base & ~mask) | (value & mask)
+            self._dirty.add(channel)
+            self._cond.notify()
+
+    def play(self, com, timeline):
+        """
+        Starts `timeline` on device `com` and returns it.
+        """
+        with self._cond:
+            channel = self._channel(com)
+            previous = timeline._channel
+            if timeline._scheduler is self and timeline in previous.timelines:  # restart
+                previous.timelines.remove(timeline)
+                self._dirty.add(previous)
+            timeline._run += 1
+            timeline._index = 0
+            timeline._remaining = timeline.repeat
+            timeline.cancelled = False
+            timeline._done.clear()
+            timeline._scheduler = self
+            timeline._channel = channel
+            channel.timelines.append(timeline)
+            heapq.heappush(self._heap, (time.monotonic() + timeline.steps[0][0],
+                                        next(self._sequence), channel, timeline, timeline._run))
+            self._dirty.add(channel)
+            self._cond.notify()
+        return timeline
+
+    def _cancelled(self, timeline):
+        with self._cond:
+            channel = timeline._channel
+            if timeline in channel.timelines:
+                channel.timelines.remove(timeline)
+                self._dirty.add(channel)
+                self._cond.notify()
+
+    def remove(self, com):
+        """
+        Forgets device `com` and cancels its timelines.
+        """
+        with self._cond:
+            channel = self._channels.pop(com, None)
+            if channel is not None:
+                for timeline in list(channel.timelines):
+                    timeline.cancel()
+                self._dirty.discard(channel)
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify()
+
+    def _advance(self, now):
+        """
+        Moves all timelines whose current step ends before now + TICK to
+        their next step.
+        """
+        heap = self._heap
+        while heap and heap[0][0] <= now + self.TICK:
+            due, _, channel, timeline, run = heapq.heappop(heap)
+            if timeline.cancelled or run != timeline._run:
+                continue
+            timeline._index += 1
+            if timeline._index == len(timeline.steps):
+                timeline._index = 0
+                if timeline._remaining > 0:
+                    timeline._remaining -= 1
+                    if timeline._remaining == 0:
+                        channel.timelines.remove(timeline)
+                        self._dirty.add(channel)
+                        timeline._done.set()
+                        continue
+            heapq.heappush(heap, (due + timeline.steps[timeline._index][0],
+                                  next(self._sequence), channel, timeline, run))
+            self._dirty.add(channel)
+
+    @staticmethod
+    def _compose(channel):
+        state = channel.base
+        # sort() is stable: for equal priorities, later timelines win
+        for timeline in sorted(channel.timelines, key=lambda timeline: timeline.priority):
+            _, value, mask = timeline.steps[timeline._index]
+            state = (state & ~mask) | (value & mask)
+        return state
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self.running and not self._dirty:
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if not self.running:
+                    return
+                self._advance(time.monotonic())
+                updates = [(channel, self._compose(channel)) for channel in self._dirty]
+                self._dirty.clear()
+            for channel, state in updates:
+                if state != channel.sent:
+                    self._send(channel, state)
+
+    def _send(self, channel, state):
+        com = channel.com
+        changed = state ^ channel.sent if channel.sent is not None else 0xff
+        if changed & 0xf0:  # the LED report carries the rumble bit, too
+            com.send_leds(state & 0xf0, rumble=bool(state & 0x01))
+        else:
+            com.set_rumble(bool(state & 0x01))
+        channel.sent = state
+        self.reports_sent += 1
+
+# ########################################################### #
+
+
+class LEDs(object):
+    """
+    Represents the LEDs of the Wiimote.
+    """
+
+    BITS = [0x10, 0x20, 0x40, 0x80]
+
+    def __init__(self, wiimote):
+        self._state = [False, False, False, False]
+        self._com = wiimote._com
+        self._scheduler = wiimote._scheduler
+
+    def __len__(self):
+        return len(self._state)
+
+    def __repr__(self):
+        return repr(self._state)
 
     def __getitem__(self, led_no):
         if 0 <= led_no <= 3:
@@ -331,15 +1466,36 @@ class LEDs(object):
         """
         Set leds 1-4.
         led_list: list of four boolean values representing the states of the LEDs
+        LED animations (see animate()) take precedence while they run.
         """
         for led_no, val in enumerate(led_list):
             self._state[led_no] = True if val else False
-        RPT_LED = 0x11
-        led_byte = 0x00
-        for val, state in zip([0x10, 0x20, 0x40, 0x80], self._state):
-            if state:
-                led_byte += val
-        self._com._send(RPT_LED, led_byte)
+        self._scheduler.set_state(self._com, LEDs._byte(self._state), 0xf0)
+
+    @staticmethod
+    def _byte(led_list):
+        return sum(bit for bit, state in zip(LEDs.BITS, led_list) if state)
+
+    def animate(self, patterns, interval=0.1, repeat=1, priority=0):
+        """
+        Shows each of `patterns` (lists of four LED states) for `interval`
+        seconds, `repeat` times (0: until cancelled).
+        Returns the ActuatorTimeline.
+        """
+        steps = [(interval, LEDs._byte(pattern), 0xf0) for pattern in patterns]
+        return self._scheduler.play(self._com, ActuatorTimeline(steps, repeat, priority))
+
+    def blink(self, led_no, rate=2.0, count=0, priority=0):
+        """
+        Blinks LED `led_no` `rate` times per second, `count` times
+        (0: until cancelled). The other LEDs are not affected.
+        Returns the ActuatorTimeline.
+        """
+        if rate <= 0:
+            raise ValueError("blink rate needs to be greater than 0")
+        bit = LEDs.BITS[led_no]
+        steps = [(0.5 / rate, bit, bit), (0.5 / rate, 0x00, bit)]
+        return self._scheduler.play(self._com, ActuatorTimeline(steps, count, priority))
 
 
 class Rumbler(object):
@@ -349,80 +1505,269 @@ class Rumbler(object):
     def __init__(self, wiimote):
         self._state = False
         self.wiimote = wiimote
+        self._scheduler = wiimote._scheduler
 
     def set_rumble(self, state):
         """
         Activate or deactivate the rumble motor.
         state: True or False
+        Rumble patterns (see pattern()) take precedence while they run.
         """
         self._state = state
-        self.wiimote._com.set_rumble(state)
+        self._scheduler.set_state(self.wiimote._com, 0x01 if state else 0x00, 0x01)
 
-    def rumble(self, length=0.5):
+    def rumble(self, length=0.5, priority=0):
         """
         Activate the rumble motor for `length` seconds.
+        Overlapping calls keep the motor running until the last one ends.
+        Returns the ActuatorTimeline.
         """
-        t = threading.Timer(length, self.set_rumble, [False])
-        t.start()
-        self.set_rumble(True)
+        return self.pattern([(True, length)], priority=priority)
+
+    def pattern(self, pattern, repeat=1, priority=0):
+        """
+        Plays a rumble pattern, a list of (on, seconds) tuples,
+        `repeat` times (0: until cancelled).
+        Returns the ActuatorTimeline.
+        """
+        steps = [(seconds, 0x01 if on else 0x00, 0x01) for on, seconds in pattern]
+        return self._scheduler.play(self.wiimote._com, ActuatorTimeline(steps, repeat, priority))
+
+
+def _encode_adpcm(samples):
+    """
+    Encodes int16 `samples` to the Yamaha 4-bit ADPCM format of the
+    Wiimote speaker (two samples per byte, first sample in the high nibble).
+    """
+    index_scale = (230, 230, 230, 230, 307, 409, 512, 614)
+    predictor = 0
+    step = 127
+    nibbles = []
+    for sample in samples.tolist():
+        delta = sample - predictor
+        nibble = min(7, abs(delta) * 4 // step)
+        predictor += step * (2 * nibble + 1) // 8 * (-1 if delta < 0 else 1)
+        predictor = max(-32768, min(32767, predictor))
+        step = max(127, min(24576, step * index_scale[nibble] >> 8))
+        nibbles.append(nibble | 8 if delta < 0 else nibble)
+    if len(nibbles) % 2:
+        nibbles.append(0)
+    return bytes((high << 4) | low for high, low in zip(nibbles[0::2], nibbles[1::2]))
 
 
 class Speaker(object):
     """
     Represents the speaker of the Wiimote.
+
+    Clips are played by a background thread, so play() and beep() return
+    immediately. The speaker is configured once and only reconfigured when
+    a clip needs another format, rate or volume. Audio reports (20 bytes of
+    data each) are queued up to LEAD seconds ahead with a deadline from a
+    fixed schedule, and the OutputWriter sends each of them at its
+    deadline; the deviation from that schedule is reported by stats().
     """
+
+    PCM8 = 'pcm8'  # 8 bit signed PCM, 20 samples per report
+    ADPCM = 'adpcm'  # Yamaha 4 bit ADPCM, 40 samples per report
+
+    # format -> (format register value, clock for the rate divider, samples per report, volume)
+    FORMATS = {PCM8: (0x40, 12000000, 20, 0x30),
+               ADPCM: (0x00, 6000000, 40, 0x40)}
+
+    CACHE_SIZE = 32  # encoded clips
+    LEAD = 0.02  # s
+
+    BEEP = bytes([255-128, 255-167, 255-202, 255-231, 255-249, 255-255, 255-249, 255-231, 255-202, 255-167,
+                  255-128, 88, 53, 24, 6, 0, 6, 24, 53, 88]) * 20
+
     def __init__(self, wiimote):
-        self._playing = False
         self.wiimote = wiimote
         self._com = wiimote._com
+        self._config = None  # (format, rate, volume) the speaker is set up for
+        self._queue = collections.deque()  # (data, config, future)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._playing = False
+        self._cancel = False
+        self._cache = collections.OrderedDict()  # (format, samples) -> encoded bytes
+        self.reports_sent = 0
+        self.lateness = Histogram(Histogram.DURATION_BOUNDS)  # us behind schedule
+
+    def encode(self, samples, format=PCM8):
+        """
+        Encodes `samples` (a NumPy array of floats between -1 and 1 or of
+        int16 values) to `format`. Results are kept in an LRU cache, so
+        replaying a clip does not encode it again.
+        """
+        samples = np.asarray(samples)
+        if samples.dtype.kind == 'f':
+            samples = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+        else:
+            samples = samples.astype(np.int16, copy=False)
+        key = (format, samples.tobytes())
+        data = self._cache.get(key)
+        if data is not None:
+            self._cache.move_to_end(key)
+            return data
+        if format == Speaker.PCM8:
+            data = (samples >> 8).astype(np.int8).tobytes()
+        elif format == Speaker.ADPCM:
+            data = _encode_adpcm(samples)
+        else:
+            raise ValueError("unknown speaker format '%s'" % format)
+        self._cache[key] = data
+        if len(self._cache) > Speaker.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return data
+
+    def play(self, samples, rate=2000, format=PCM8, volume=None):
+        """
+        Queues a clip and returns a concurrent.futures.Future that is done
+        once the clip has been sent, or raises concurrent.futures.CancelledError
+        if it is stopped before.
+        `samples` are either already encoded bytes or an array that is
+        encoded with encode(). `rate` is the sample rate in Hz.
+        """
+        if format not in Speaker.FORMATS:
+            raise ValueError("unknown speaker format '%s'" % format)
+        if not isinstance(samples, (bytes, bytearray)):
+            samples = self.encode(samples, format)
+        if volume is None:
+            volume = Speaker.FORMATS[format][3]
+        future = concurrent.futures.Future()
+        with self._cond:
+            self._queue.append((bytes(samples), (format, rate, volume), future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="Speaker")
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def is_playing(self):
+        return bool(self._queue) or self._playing
+
+    def stop(self):
+        """
+        Stops the current clip and discards all queued clips.
+        """
+        with self._cond:
+            self._cancel = True
+            queued = list(self._queue)
+            self._queue.clear()
+        for _, _, future in queued:
+            future.cancel()
 
     def beep(self):
         """
-        Play a short beep through the speaker
+        Play a short beep through the speaker, unless a clip is playing.
         """
-        if self._playing:
-            return
-        self._playing = True
-        RPT_SPKR_ON = 0x14
-        RPT_SPKR_MUTE = 0x19
-        RPT_SPKR_PLAY = 0x18
-        ON = 0x04
-        OFF = 0x00
-        self._com._send(RPT_SPKR_ON, ON)
-        self._com._send(RPT_SPKR_MUTE, ON)
-        # Write 0x01 to register 0xa20009
-        self.wiimote.memory.write(0xa20009, [0x01])
-        # Write 0x08 to register 0xa20001
-        self.wiimote.memory.write(0xa20001, [0x08])
-        # set up for 8-Bit PCM, 1000 Hz, see http://wiibrew.org/wiki/Wiimote#Speaker
-        self.wiimote.memory.write(0xa20001, [0x00, 0x40, 0x70, 0x17, 0x30, 0x00, 0x00])
-        self.wiimote.memory.write(0xa20008, [0x01])
-        self._com._send(RPT_SPKR_MUTE, OFF)
-        time.sleep(0.05)
-        num_samples = 20
-        # samples = [0, 30, 60, 90, 120, 90, 60, 30, 0, 255-30, 255-60, 255-90, 255-120, 255-90, 255-60, 255-30, 0, 0, 0, 0]
-        # samples = [0, 120, 240, 0, 120, 240, 0, 120, 240, 0, 120, 240, 0, 120, 240, 0, 120, 240, 0, 0]
-        # samples = [128,167,202,231,249,255,249,231,202,167,128,88,53,24,6,0,6,24,53,88,]
-        # samples = [0, 30, 60, 90, 120, 150, 180, 210, 240, 210, 180, 150, 120, 90, 60, 30, 0, 0, 0, 0]
-        samples = [255-128, 255-167, 255-202, 255-231, 255-249, 255-255, 255-249, 255-231, 255-202, 255-167, 255-128, 88, 53, 24, 6, 0, 6, 24, 53, 88, ]
-        for _ in range(20):
-            self._com._send(RPT_SPKR_PLAY, num_samples << 3, samples)
-            time.sleep(0.01)
-            # currently, timing does not seem to be the reason why  audio sounds awful - stay with time.sleep()
-            # nsleep(9000)
-        self._com._send(RPT_SPKR_ON, OFF)
-        self._playing = False
+        if self.is_playing():
+            return None
+        return self.play(Speaker.BEEP)
+
+    def stats(self):
+        """
+        Returns the number of audio reports sent and how far (in us) they
+        were sent behind schedule.
+        """
+        return {'reports': self.reports_sent, 'lateness_us': self.lateness.summary()}
+
+    def disable(self):
+        """
+        Stops playback and switches the speaker off. It is configured
+        again by the next play().
+        """
+        self.stop()
+        with self._cond:
+            self._config = None
+            self._com.send_speaker_enable(False)
+
+    def _configure(self, config):
+        format, rate, volume = config
+        register, clock = Speaker.FORMATS[format][:2]
+        divider = clock // rate
+        memory = self.wiimote.memory
+        if self._config is None:
+            self._com.send_speaker_enable(True)
+            self._com.send_speaker_mute(True)
+            # the speaker forgets its configuration when it is switched off
+            memory.invalidate_shadow(0xa20001, 9)
+            with memory.batch():
+                memory.write(0xa20009, [0x01])
+                memory.write(0xa20001, [0x08], force=True)
+                memory.write(0xa20001, [0x00, register, divider & 0xff, divider >> 8, volume, 0x00, 0x00])
+                memory.write(0xa20008, [0x01])
+        else:
+            self._com.send_speaker_mute(True)
+            memory.write(0xa20001, [0x00, register, divider & 0xff, divider >> 8, volume, 0x00, 0x00])
+        self._com.send_speaker_mute(False)
+        self._config = config
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._playing = False
+                    self._cond.wait()
+                data, config, future = self._queue.popleft()
+                self._playing = True
+                self._cancel = False
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if config != self._config:
+                    self._configure(config)
+                if self._send_clip(data, config):
+                    future.set_result(None)
+                else:  # already running, so future.cancel() would not work
+                    future.set_exception(concurrent.futures.CancelledError())
+            except Exception as e:
+                future.set_exception(e)
+
+    def _send_clip(self, data, config):
+        """
+        Sends a clip in real time. Returns False if it was stopped.
+        """
+        format, rate, _ = config
+        samples_per_report = Speaker.FORMATS[format][2]
+        period = samples_per_report / rate
+        clock = time.monotonic
+        deadline = clock()
+        for offset in range(0, len(data), 20):
+            if self._cancel:
+                return False
+            remaining = deadline - Speaker.LEAD - clock()
+            if remaining > 0:
+                nsleep(remaining * 1e6)
+            self._com.send_speaker_data(data[offset:offset + 20], deadline, self.lateness)
+            self.reports_sent += 1
+            deadline += period
+        # the last LEAD seconds of audio are still queued in the OutputWriter
+        self._com.flush(Speaker.LEAD + 1.0)
+        return True
 
 
 class IRCam(object):
     """
     Represents the infrared camera of the Wiimote.
+
+    The camera tracks up to four IR objects (blobs). The latest frame is
+    kept in `frame`, a preallocated (4, FIELDS) uint16 array with one row
+    per slot and the columns X, Y, SIZE, XMIN, YMIN, XMAX, YMAX, INTENSITY
+    and VALID (1 if the slot holds a blob). Coordinates range from 0 to
+    1023 (x) and 767 (y). The bounding box and intensity are only
+    reported in MODE_FULL, the size not in MODE_BASIC; otherwise these
+    columns are 0.
     """
 
     MODE_BASIC = 1
     MODE_EXTENDED = 3
     MODE_FULL = 5
 
+    X, Y, SIZE, XMIN, YMIN, XMAX, YMAX, INTENSITY, VALID = range(9)
+    FIELDS = 9
+
     # adapted from WiiBrew list, higher index means higher sensitivity
     SENSITIVITY_BLOCKS = [
         ([0x02, 0x00, 0x00, 0x71, 0x01, 0x00, 0x64, 0x00, 0xfe], [0xfd, 0x05]),  # Wii Level 1
@@ -435,55 +1780,97 @@ class IRCam(object):
 
     SUPPORTED_REPORTS = [0x33, 0x36, 0x37, 0x3e, 0x3f]
 
+    BUFFER_SIZE = 4096
+
     def __init__(self, wiimote):
         self.wiimote = wiimote
         self._com = wiimote._com
-        self._state = []
-        self._callbacks = []
+        # decoders write single values into the array.array, which is
+        # much faster than item assignment on the NumPy view sharing its memory
+        self._values = array.array('H', bytes(2 * 4 * IRCam.FIELDS))
+        self.frame = np.frombuffer(self._values, dtype=np.uint16).reshape(4, IRCam.FIELDS)
+        # one frame per row, see `frame`
+        self.samples = SampleBuffer((4, IRCam.FIELDS), capacity=IRCam.BUFFER_SIZE, dtype=np.uint16)
+        self._half_frame = False
+        self._full_columns = False  # columns XMIN..INTENSITY hold full mode data
+        self._callbacks = _CallbackList()
+        self._readers = weakref.WeakSet()
+        self._enabled = False
+        self._camera_on = False
         self._mode = self.MODE_EXTENDED
         self._sensitivity = 3
-        self.set_mode_sensitivity(self._mode, self._sensitivity)
 
     def __len__(self):
-        return len(self._state)
+        return int(np.count_nonzero(self.frame[:, IRCam.VALID]))
 
     def __repr__(self):
-        return repr(self._state)
+        return repr(self.get_state())
 
     def __getitem__(self, slot):
-        if 0 <= slot < len(self._state):
-            return self._state[slot]
-        else:
-            raise IndexError("list index out of range")
+        return self.get_state()[slot]
+
+    @property
+    def valid(self):
+        """ boolean mask of the slots that hold a blob """
+        return self.frame[:, IRCam.VALID].astype(bool)
 
     def set_mode_sensitivity(self, mode, sensitivity):
         """
         Sets sensitivity and verbosity of IR camera.
         Valid values for mode: `IRCam.MODE_BASIC`, `IRCam.MODE_EXTENDED`, `IRCam.MODE_FULL`.
-        Valid values for sensitivity: 0 (lowest) to 6 (highest).
+        Valid values for sensitivity: 0 (lowest) to 5 (highest).
         Default mode: MODE_EXTENDED
         Default sensitivity: 3
+        The camera is only powered while it is in use (see is_active()),
+        the settings are applied whenever it is switched on.
         See WiiBrew documentation.
         """
-        if sensitivity > len(self.SENSITIVITY_BLOCKS) - 1 or \
+        if not 0 <= sensitivity < len(self.SENSITIVITY_BLOCKS) or \
            (mode not in [self.MODE_BASIC, self.MODE_EXTENDED, self.MODE_FULL]):
             raise TypeError("wrong mode or sensitivity level given")
         self._mode = mode
         self._sensitivity = sensitivity
-        self._com.set_report_mode(0x33)  # todo: adjust for other modes!!
-        self._com._send(0x13, 0x04)
-        self._com._send(0x1a, 0x04)
-        self.wiimote.memory.write(0xb00030, 0x08, eeprom=False)
-        self.wiimote.memory.write(0xb00000, self.SENSITIVITY_BLOCKS[mode][0], eeprom=False)
-        self.wiimote.memory.write(0xb0001a, self.SENSITIVITY_BLOCKS[mode][1], eeprom=False)
-        self.wiimote.memory.write(0xb00033, mode, eeprom=False)
-        self.wiimote.memory.write(0xb00030, 0x08, eeprom=False)
+        if self._camera_on:
+            self._configure()
+        self._com.select_report_mode()
+
+    def _configure(self):
+        with self.wiimote.memory.batch():
+            # writes to 0xb00030 enable/commit the configuration, always send them
+            self.wiimote.memory.write(0xb00030, 0x08, eeprom=False, force=True)
+            self.wiimote.memory.write(0xb00000, self.SENSITIVITY_BLOCKS[self._sensitivity][0], eeprom=False)
+            self.wiimote.memory.write(0xb0001a, self.SENSITIVITY_BLOCKS[self._sensitivity][1], eeprom=False)
+            self.wiimote.memory.write(0xb00033, self._mode, eeprom=False)
+            self.wiimote.memory.write(0xb00030, 0x08, eeprom=False, force=True)
+
+    def update_camera(self):
+        """
+        Powers the camera on or off depending on is_active() and returns
+        the IR mode the data reporting mode needs to carry (None if off).
+        Called by CommunicationHandler.select_report_mode().
+        """
+        active = self.is_active()
+        if active and not self._camera_on:
+            self._com.send_ir_enable(True)
+            self.wiimote.memory.invalidate_shadow(0xb00000, 0x34)  # registers are reset
+            self._configure()
+        elif not active and self._camera_on:
+            self._com.send_ir_enable(False)
+        self._camera_on = active
+        return self._mode if active else None
 
     def disable(self):
-        pass
+        self.set_enabled(False)
 
     def get_state(self):
-        return self._state
+        """
+        Returns a list with a dict (id, x, y, size, bbox, intensity) for
+        every visible blob; `id` is the slot number.
+        """
+        return [{'id': slot, 'x': int(row[IRCam.X]), 'y': int(row[IRCam.Y]), 'size': int(row[IRCam.SIZE]),
+                 'bbox': tuple(int(v) for v in row[IRCam.XMIN:IRCam.YMAX + 1]),
+                 'intensity': int(row[IRCam.INTENSITY])}
+                for slot, row in enumerate(self.frame.tolist()) if row[IRCam.VALID]]
 
     def set_sensitivity(self, sensitivity):
         self.set_mode_sensitivity(self._mode, sensitivity)
@@ -491,30 +1878,351 @@ class IRCam(object):
     def set_mode(self, mode):
         self.set_mode_sensitivity(mode, self._sensitivity)
 
-    def register_callback(self, func):
-        self._callbacks.append(func)
+    def reader(self):
+        """
+        Returns a SampleReader for lossless access to all IR frames,
+        each in the layout of `frame`.
+        """
+        reader = self.samples.reader()
+        _add_reader(self._readers, reader, self._com)
+        return reader
+
+    def stream(self, max_batch=64, interval=0.0):
+        """
+        Async generator yielding (timestamps, frames) arrays of up to
+        `max_batch` IR frames, see Accelerometer.stream().
+        """
+        return _stream_samples(self, max_batch, interval)
+
+    def set_enabled(self, enabled):
+        """
+        The camera is switched on and IR reports are decoded while it is
+        enabled or has callbacks or readers. Enable it to poll the IR state
+        without a callback.
+        """
+        self._enabled = enabled
+        self._com.update_dispatch()
+
+    def is_active(self):
+        return self._enabled or bool(self._callbacks) or _has_readers(self._readers)
+
+    def register_callback(self, func, policy=Subscription.DROP_OLDEST, maxsize=256):
+        """
+        Register `func` to be called with a copy of `frame` for every IR
+        frame, see Accelerometer.register_callback().
+        """
+        subscription = self._callbacks.add(func, policy, maxsize)
+        self._com.update_dispatch()
+        return subscription
+
+    def unregister_callback(self, func):
+        if self._callbacks.remove(func):
+            self._com.update_dispatch()
+
+    def _notify_callbacks(self, timestamp=None):
+        self._callbacks.notify(self.frame.copy(), timestamp)
+
+    def handle_report(self, report, timestamp=None):
+        rpt = report[0]
+        values = self._values
+        if rpt >= 0x3e:
+            self._full_columns = True
+            if rpt == 0x3e:  # first half of a full mode frame
+                self._decode_full(report, 4, 0, values)
+                self._half_frame = True
+                return
+            if not self._half_frame:  # first half got lost
+                return
+            self._half_frame = False
+            self._decode_full(report, 4, 2, values)
+        else:
+            if self._full_columns:  # switched from full mode: clear bounding box and intensity
+                self.frame[:, IRCam.XMIN:IRCam.VALID] = 0
+                self._full_columns = False
+            if rpt == 0x33:
+                self._decode_extended(report, 6, values)
+            else:
+                self._decode_basic(report, 3 if rpt == 0x36 else 6, values)
+        self.samples.append(self.frame, timestamp)
+        if self._callbacks:
+            self._notify_callbacks(timestamp)
+
+    @staticmethod
+    def _decode_extended(report, offset, values):
+        # 3 bytes per blob: X, Y, Y<9:8> X<9:8> size
+        for slot in range(4):
+            i = offset + 3 * slot
+            b2 = report[i + 2]
+            x = report[i] | ((b2 & 0b00110000) << 4)
+            y = report[i + 1] | ((b2 & 0b11000000) << 2)
+            j = slot * IRCam.FIELDS
+            values[j] = x
+            values[j + 1] = y
+            values[j + 2] = b2 & 0b00001111
+            values[j + 8] = y != 0x3ff
+
+    @staticmethod
+    def _decode_basic(report, offset, values):
+        # 5 bytes per pair of blobs: X1, Y1, Y1<9:8> X1<9:8> Y2<9:8> X2<9:8>, X2, Y2
+        for pair in range(2):
+            i = offset + 5 * pair
+            b2 = report[i + 2]
+            for slot, x, y in ((2 * pair, report[i] | ((b2 & 0b00110000) << 4),
+                                report[i + 1] | ((b2 & 0b11000000) << 2)),
+                               (2 * pair + 1, report[i + 3] | ((b2 & 0b00000011) << 8),
+                                report[i + 4] | ((b2 & 0b00001100) << 6))):
+                j = slot * IRCam.FIELDS
+                values[j] = x
+                values[j + 1] = y
+                values[j + 2] = 0
+                values[j + 8] = y != 0x3ff
+
+    @staticmethod
+    def _decode_full(report, offset, first_slot, values):
+        # 9 bytes per blob: extended mode bytes, bounding box (7 bit each,
+        # in units of 8 pixels), a zero byte and the intensity
+        for slot in range(first_slot, first_slot + 2):
+            i = offset + 9 * (slot - first_slot)
+            b2 = report[i + 2]
+            y = report[i + 1] | ((b2 & 0b11000000) << 2)
+            j = slot * IRCam.FIELDS
+            values[j] = report[i] | ((b2 & 0b00110000) << 4)
+            values[j + 1] = y
+            values[j + 2] = b2 & 0b00001111
+            values[j + 3] = (report[i + 3] & 0x7f) << 3
+            values[j + 4] = (report[i + 4] & 0x7f) << 3
+            values[j + 5] = (report[i + 5] & 0x7f) << 3
+            values[j + 6] = (report[i + 6] & 0x7f) << 3
+            values[j + 7] = report[i + 8]
+            values[j + 8] = y != 0x3ff
+
+
+Track = collections.namedtuple('Track', ['id', 'x', 'y', 'vx', 'vy', 'size', 'missed'])
+Track.__doc__ = """
+A tracked IR blob. `x`, `y` are the filtered position, `vx`, `vy` the
+velocity in pixels per second. `missed` counts the frames since the blob
+was last seen (its position is predicted meanwhile).
+"""
+
+
+class IRTracker(object):
+    """
+    Follows the blobs of an IRCam across frames and gives each one a
+    stable track ID, unlike the slot numbers, which the camera reassigns
+    when blobs appear or disappear.
+
+    Blobs are assigned to tracks by minimizing the total distance to the
+    predicted track positions (exhaustively, there are at most 4 blobs).
+    Blobs farther than `max_distance` pixels from every prediction start a
+    new track; tracks without a blob for more than `max_missed` frames end.
+    Each track runs a constant-velocity Kalman filter, which smooths the
+    positions and lets predict() extrapolate between reports.
+
+    Example:
+        tracker = IRTracker(wm.ir)
+        ...
+        for track in tracker.predict(time.monotonic()):
+            print(track.id, track.x, track.y)
+    """
+
+    MAX_TRACKS = 4
+    PROCESS_NOISE = 3000.0  # std. dev. of the acceleration, px/s^2
+    MEASUREMENT_NOISE = 2.0  # std. dev. of the blob position, px
+
+    # number of blobs n -> all injective maps of the n blobs onto the
+    # MAX_TRACKS track rows and MAX_TRACKS "new track" rows
+    _assignments = {}
+
+    def __init__(self, ir=None, max_distance=100.0, max_missed=5,
+                 process_noise=PROCESS_NOISE, measurement_noise=MEASUREMENT_NOISE):
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        n = IRTracker.MAX_TRACKS
+        self._ids = np.zeros(n, dtype=np.int64)
+        self._active = np.zeros(n, dtype=bool)
+        self._missed = np.zeros(n, dtype=np.int64)
+        self._size = np.zeros(n, dtype=np.int64)
+        self._pos = np.zeros((n, 2))  # x, y
+        self._vel = np.zeros((n, 2))
+        self._cov = np.zeros((n, 3))  # P00, P01 (= P10), P11; the same for both axes
+        self._next_id = 0
+        self._last_time = None
+        self._lock = threading.Lock()
+        self._callbacks = _CallbackList()
+        self._ir = None
+        self._reader = None
+        if ir is not None:
+            self.start(ir)
+
+    def start(self, ir):
+        """
+        Tracks all frames of IRCam `ir` on a delivery thread.
+        """
+        self.stop()
+        self._ir = ir
+        self._reader = ir.reader()
+        ir.register_callback(self._frames_received, Subscription.BATCH)
+
+    def stop(self):
+        if self._ir is not None:
+            ir, self._ir, self._reader = self._ir, None, None
+            ir.unregister_callback(self._frames_received)
+
+    def _frames_received(self, frames):
+        # the reader provides the timestamps and never skips a frame
+        reader = self._reader
+        if reader is None:  # stopped
+            return
+        for timestamp, frame in zip(*reader.read()):
+            self.update(frame, timestamp)
+
+    def register_callback(self, func, policy=Subscription.DROP_OLDEST, maxsize=256):
+        """
+        Register `func` to be called with the list of Tracks after every frame.
+        """
+        return self._callbacks.add(func, policy, maxsize)
 
     def unregister_callback(self, func):
-        if func in self._callbacks:
-            self._callbacks.remove(func)
-
-    def _notify_callbacks(self):
-        for callback in self._callbacks:
-            callback(self._state)
-
-    def handle_report(self, report):
-        assert(report[0] in self.SUPPORTED_REPORTS)
-        # only extended mode for now!
-        ir_data = report[6:]
-        self._state = []
-        for ir_obj in range(4):
-            data = ir_data[ir_obj*3:(ir_obj+1)*3]
-            x = data[0] + ((data[2] & 0b00110000) << 4)
-            y = data[1] + ((data[2] & 0b11000000) << 2)
-            size = data[2] & 0b00001111
-            if size != 0:
-                self._state.append({'id': ir_obj, 'x': x, 'y': y, 'size': size})
-        self._notify_callbacks()
+        self._callbacks.remove(func)
+
+    def update(self, frame, timestamp):
+        """
+        Updates the tracks with an IR frame (see IRCam.frame) received at
+        `timestamp` (time.monotonic() seconds) and returns the current tracks.
+        """
+        valid = frame[:, IRCam.VALID] != 0
+        blobs = frame[valid][:, [IRCam.X, IRCam.Y]].astype(np.float64)
+        sizes = frame[valid][:, IRCam.SIZE]
+        with self._lock:
+            if self._last_time is not None:
+                self._predict_step(max(timestamp - self._last_time, 0.0))
+            self._last_time = timestamp
+            rows = self._assign(blobs)
+            self._missed[self._active] += 1
+            for blob, row in enumerate(rows):
+                if row >= IRTracker.MAX_TRACKS:
+                    row = self._new_track(blobs[blob])
+                    if row is None:
+                        continue
+                else:
+                    self._correct(row, blobs[blob])
+                self._missed[row] = 0
+                self._size[row] = sizes[blob]
+            self._active &= self._missed <= self.max_missed
+            tracks = self._tracks(self._pos, self._vel)
+        if self._callbacks:
+            self._callbacks.notify(tracks, timestamp)
+        return tracks
+
+    def tracks(self):
+        """
+        Returns the current tracks (filtered positions at the last frame).
+        """
+        with self._lock:
+            return self._tracks(self._pos, self._vel)
+
+    def predict(self, timestamp):
+        """
+        Returns the tracks with their positions extrapolated to `timestamp`,
+        e.g. time.monotonic() to compensate for the report interval.
+        """
+        with self._lock:
+            if self._last_time is None:
+                return []
+            dt = timestamp - self._last_time
+            return self._tracks(self._pos + self._vel * dt, self._vel)
+
+    def _tracks(self, pos, vel):
+        return [Track(int(self._ids[row]), float(pos[row, 0]), float(pos[row, 1]),
+                      float(vel[row, 0]), float(vel[row, 1]), int(self._size[row]), int(self._missed[row]))
+                for row in np.flatnonzero(self._active)]
+
+    def _predict_step(self, dt):
+        """
+        Kalman prediction for all tracks: x += v * dt, P = F P F^T + Q.
+        """
+        self._pos += self._vel * dt
+        p00, p01, p11 = self._cov.T
+        q = self.process_noise ** 2
+        self._cov[:, 0] = p00 + 2 * dt * p01 + dt * dt * p11 + q * dt ** 4 / 4
+        self._cov[:, 1] = p01 + dt * p11 + q * dt ** 3 / 2
+        self._cov[:, 2] = p11 + q * dt * dt
+
+    def _correct(self, row, blob):
+        """
+        Kalman update of track `row` with a measured position.
+        """
+        p00, p01, p11 = self._cov[row]
+        s = p00 + self.measurement_noise ** 2
+        k0, k1 = p00 / s, p01 / s
+        innovation = blob - self._pos[row]
+        self._pos[row] += k0 * innovation
+        self._vel[row] += k1 * innovation
+        self._cov[row] = ((1 - k0) * p00, (1 - k0) * p01, p11 - k1 * p01)
+
+    def _assign(self, blobs):
+        """
+        Returns the row for every blob: a track row, or a value
+        >= MAX_TRACKS for blobs that start a new track.
+        """
+        n = len(blobs)
+        if n == 0:
+            return ()
+        cost = np.full((2 * IRTracker.MAX_TRACKS, n), self.max_distance)
+        distance = np.hypot(*(self._pos[:, np.newaxis, :] - blobs[np.newaxis, :, :]).transpose(2, 0, 1))
+        distance[~self._active] = np.inf
+        distance[distance > self.max_distance] = np.inf
+        cost[:IRTracker.MAX_TRACKS] = distance
+        assignments = IRTracker._assignments.get(n)
+        if assignments is None:
+            assignments = np.array(list(itertools.permutations(range(2 * IRTracker.MAX_TRACKS), n)),
+                                   dtype=np.intp)
+            IRTracker._assignments[n] = assignments
+        total = cost[assignments, np.arange(n)].sum(axis=1)
+        return assignments[np.argmin(total)]
+
+    def _new_track(self, blob):
+        """
+        Starts a track in a free row, or in the row of the track that has
+        been missing for the longest time. Returns None if all tracks have
+        been seen in this frame.
+        """
+        candidates = np.flatnonzero(~self._active)
+        if len(candidates):
+            row = candidates[0]
+        else:
+            row = int(np.argmax(self._missed))
+            if self._missed[row] == 0:
+                return None
+        self._ids[row] = self._next_id
+        self._next_id += 1
+        self._active[row] = True
+        self._pos[row] = blob
+        self._vel[row] = 0.0
+        self._cov[row] = (self.measurement_noise ** 2, 0.0, 1e6)  # velocity unknown
+        return row
+
+
+class _MemoryRead(object):
+    """
+    A memory read request that has been queued or sent to the Wiimote.
+    """
+
+    def __init__(self, address, amount, eeprom, timeout):
+        self.address = address
+        self.amount = amount
+        self.eeprom = eeprom
+        self.timeout = timeout
+        self.timer = None  # fails the request if no reply arrives in time
+        self.data = []
+        self.future = concurrent.futures.Future()
+
+    @property
+    def next_address(self):
+        """ lower 16 bits of the address the next 0x21 reply refers to """
+        return (self.address + len(self.data)) & 0xffff
 
 
 class Memory(object):
@@ -526,158 +2234,1577 @@ class Memory(object):
 
     MAX_ADDRESS = 0x16FF
 
+    # Number of read requests sent to the Wiimote before the previous ones
+    # have been answered. Further requests wait in a queue and are sent
+    # from handle_report() as soon as a slot becomes free.
+    MAX_READS_IN_FLIGHT = 1
+    # Seconds a sent read request may wait for its replies before it fails
+    # and frees its slot, e.g. if a reply got lost.
+    READ_TIMEOUT = 1.0
+
     def __init__(self, wiimote):
         self.wiimote = wiimote
         self._com = wiimote._com
-        self._request_in_progress = False
-        self._bytes_requested = 0
-        self._reply_buffer = []
+        self._lock = threading.Lock()
+        self._queued_reads = collections.deque()
+        self._reads_in_flight = []
+        self._shadow = {}  # address -> last value written to a control register
+        self._pending_writes = []  # (eeprom, address, data, force) inside batch()
+        self._batch_depth = 0
 
-    def write(self, address, data, eeprom=False):
-        address_bytes = _val_to_byte_list(address, 3, big_endian=True)
+    def write(self, address, data, eeprom=False, force=False):
+        """
+        Write `data` (a byte value or a (nested) list of byte values) to `address`.
+        Data of any length is split into 16-byte write reports.
+        For control registers (eeprom=False) a shadow copy of all written
+        values is kept, and leading/trailing bytes that would not change
+        are not sent at all. Set `force` to always write every byte, e.g.
+        for registers whose writes have side effects.
+        Inside a `with memory.batch():` block, writes are collected and
+        adjacent or overlapping writes are merged before sending.
+        """
         bytes_to_send = _flatten(data)
         amount = len(bytes_to_send)
         if eeprom and address + amount > Memory.MAX_ADDRESS:
             raise ValueError("EEPROM address needs to be between 0x0000 and 0x16FF")
         if address < 0:
             raise ValueError("Memory address needs to be greater than 0x0000")
-        # to do: send larger blocks in multiple 16-byte requests instead of failing
-        if amount > 16:
-            raise ValueError("A maximum of 16 bytes can be sent per function call")
-        amount_byte = _val_to_byte_list(amount, 1, big_endian=True)
-        bytes_to_send = _add_padding(bytes_to_send, 16)
-        control_or_eeprom = 0x00 if eeprom else 0x04
-        self._com._send(Memory.RPT_WRITE, control_or_eeprom, address_bytes, amount_byte, bytes_to_send)
+        with self._lock:
+            if not eeprom and not force:
+                address, bytes_to_send = self._trim_unchanged(address, bytes_to_send)
+                if not bytes_to_send:
+                    return
+            if self._batch_depth > 0:
+                self._add_pending_write(address, bytes_to_send, eeprom, force)
+            else:
+                self._send_write(address, bytes_to_send, eeprom)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager that collects all writes and sends them, merged
+        into as few reports as possible, when the block is left.
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    pending, self._pending_writes = self._pending_writes, []
+                    for eeprom, address, data, force in pending:
+                        self._send_write(address, data, eeprom)
+
+    def invalidate_shadow(self, address=None, amount=1):
+        """
+        Forget the shadowed values of `amount` control registers starting
+        at `address` (or of all registers), e.g. after the device reset them.
+        """
+        with self._lock:
+            if address is None:
+                self._shadow.clear()
+            else:
+                for addr in range(address, address + amount):
+                    self._shadow.pop(addr, None)
+
+    def _register_value(self, address):
+        """
+        Returns the value control register `address` will have once all
+        pending writes of the current batch are sent, or None if unknown.
+        """
+        for eeprom, start, data, force in reversed(self._pending_writes):
+            if not eeprom and start <= address < start + len(data):
+                return data[address - start]
+        return self._shadow.get(address)
+
+    def _trim_unchanged(self, address, data):
+        """
+        Strips leading and trailing bytes that already have the given value
+        according to the register shadow and the pending writes.
+        """
+        value = self._register_value
+        start, end = 0, len(data)
+        while start < end and value(address + start) == data[start]:
+            start += 1
+        while end > start and value(address + end - 1) == data[end - 1]:
+            end -= 1
+        return address + start, data[start:end]
+
+    def _add_pending_write(self, address, data, eeprom, force):
+        """
+        Appends a write to the pending writes of the current batch, merging it
+        into the previous write if both touch or overlap. For control registers,
+        small gaps are filled from the shadow and earlier pending writes if that
+        saves a report.
+        Writes are never reordered, and forced writes are never merged.
+        """
+        if self._pending_writes and not force:
+            last_eeprom, last_address, last_data, last_force = self._pending_writes[-1]
+            last_end = last_address + len(last_data)
+            start = min(address, last_address)
+            end = max(address + len(data), last_end)
+            if last_eeprom == eeprom and not last_force and \
+               self._can_merge(last_address, last_end, address, address + len(data), eeprom):
+                merged = [self._register_value(addr) for addr in range(start, end)]
+                merged[last_address - start:last_end - start] = last_data
+                merged[address - start:address - start + len(data)] = data
+                self._pending_writes[-1] = (eeprom, start, merged, False)
+                return
+        self._pending_writes.append((eeprom, address, list(data), force))
+
+    def _can_merge(self, start1, end1, start2, end2, eeprom):
+        if start2 <= end1 and start1 <= end2:  # touching or overlapping
+            return True
+        if eeprom:
+            return False
+        gap = range(end1, start2) if end1 <= start2 else range(end2, start1)
+        if any(self._register_value(addr) is None for addr in gap):
+            return False
+        separate = -(-(end1 - start1) // 16) + -(-(end2 - start2) // 16)
+        merged = -(-(max(end1, end2) - min(start1, start2)) // 16)
+        return merged < separate
 
-    def read(self, address, amount, eeprom=False):
-        if self._request_in_progress:
-            raise RuntimeError("Memory read already in progress.")
+    def _send_write(self, address, data, eeprom):
+        """
+        Sends `data` in 16-byte write reports and updates the register shadow.
+        """
+        for offset in range(0, len(data), 16):
+            self._com.send_memory_write(address + offset, data[offset:offset + 16], eeprom)
+        if not eeprom:
+            for offset, value in enumerate(data):
+                self._shadow[address + offset] = value
+
+    def read_async(self, address, amount, eeprom=False, timeout=READ_TIMEOUT):
+        """
+        Request `amount` bytes starting at `address` and return immediately.
+        Returns a concurrent.futures.Future that resolves to a list of byte
+        values, or raises RuntimeError if the Wiimote reports an error and
+        concurrent.futures.TimeoutError if the replies did not arrive within
+        `timeout` seconds after sending the request (None waits forever).
+        Several reads may be outstanding at the same time.
+        """
         if eeprom and address + amount > Memory.MAX_ADDRESS:
             raise ValueError("EEPROM address needs to be between 0x0000 and 0x16FF")
         if address < 0:
             raise ValueError("Memory address needs to be greater than 0x0000")
-        self._bytes_remaining = amount
-        address_bytes = _val_to_byte_list(address, 3, big_endian=True)
-        amount_bytes = _val_to_byte_list(amount, 2, big_endian=True)
-        control_or_eeprom = 0x00 if eeprom else 0x04
-        self._request_in_progress = True
-        self._reply_buffer = []
-        self._com._send(Memory.RPT_READ, control_or_eeprom, address_bytes, amount_bytes)
-        # now wait until handle() has filled our reply buffer
-        while self._request_in_progress:
-            time.sleep(0.01)
-        return self._reply_buffer
-
-    def handle_report(self, report):
+        if address > 0xffffff:
+            raise ValueError("Memory address needs to be less than 0x1000000")
+        if not 0 < amount <= 0xffff:
+            raise ValueError("Memory reads need to be between 1 and 0xFFFF bytes")
+        request = _MemoryRead(address, amount, eeprom, timeout)
+        with self._lock:
+            self._queued_reads.append(request)
+            self._send_queued_reads()
+        return request.future
+
+    def read(self, address, amount, eeprom=False, timeout=READ_TIMEOUT):
+        """
+        Read `amount` bytes starting at `address` and return them as a list.
+        Blocks until all data has arrived or raises
+        concurrent.futures.TimeoutError after `timeout` seconds.
+        """
+        if self._com.on_receive_thread():
+            raise RuntimeError("Memory.read() would block the CommunicationHandler, use read_async()")
+        if not self._com.is_receiving():
+            raise RuntimeError("CommunicationHandler not running, use read_async()")
+        future = self.read_async(address, amount, eeprom, timeout)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self._abort_read(future)
+            raise
+
+    async def read_coro(self, address, amount, eeprom=False, timeout=READ_TIMEOUT):
+        """
+        Coroutine version of read() for use with asyncio.
+        """
+        future = self.read_async(address, amount, eeprom, timeout)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except (asyncio.TimeoutError, concurrent.futures.TimeoutError):
+            self._abort_read(future)
+            raise
+
+    def _send_queued_reads(self):
+        """
+        Sends queued read requests while there are free slots.
+        Must be called with self._lock held.
+        """
+        while self._queued_reads and len(self._reads_in_flight) < self.MAX_READS_IN_FLIGHT:
+            request = self._queued_reads.popleft()
+            if not request.future.set_running_or_notify_cancel():
+                continue  # cancelled while waiting in the queue
+            self._reads_in_flight.append(request)
+            if request.timeout is not None:
+                request.timer = threading.Timer(request.timeout, self._expire_read, (request,))
+                request.timer.daemon = True
+                request.timer.start()
+            self._com.send_memory_read(request.address, request.amount, request.eeprom,
+                                       functools.partial(self._fail_read, request))
+
+    def _fail_read(self, request, exception):
+        """
+        Called by the OutputWriter if a read request could not be sent.
+        """
+        with self._lock:
+            self._finish_read(request)
+            self._send_queued_reads()
+        if not request.future.done():
+            request.future.set_exception(exception)
+
+    def _expire_read(self, request):
+        """
+        Called by the request's timer if its replies did not arrive in time.
+        """
+        with self._lock:
+            if request not in self._reads_in_flight:
+                return  # completed in the meantime
+            self._finish_read(request)
+            self._send_queued_reads()
+        _debug("memory read at %x timed out" % request.address)
+        if not request.future.done():
+            request.future.set_exception(concurrent.futures.TimeoutError(
+                "No reply to memory read at %x within %s s" % (request.address, request.timeout)))
+
+    def _finish_read(self, request):
+        """
+        Frees the slot of a request and stops its timer.
+        Must be called with self._lock held.
+        """
+        if request in self._reads_in_flight:
+            self._reads_in_flight.remove(request)
+        if request.timer is not None:
+            request.timer.cancel()
+
+    def _abort_read(self, future):
+        with self._lock:
+            for request in list(self._queued_reads):
+                if request.future is future:
+                    self._queued_reads.remove(request)
+            for request in list(self._reads_in_flight):
+                if request.future is future:
+                    self._finish_read(request)
+            self._send_queued_reads()
+
+    def _find_read(self, address, error):
+        for request in self._reads_in_flight:
+            if request.next_address == address:
+                return request
+        if error and self._reads_in_flight:
+            return self._reads_in_flight[0]
+        return None
+
+    def is_active(self):
+        return True
+
+    def handle_report(self, report, timestamp=None):
         if report[0] not in Memory.SUPPORTED_REPORTS:  # interleaved modes
             raise NotImplementedError("can not handle this report")
         error = (report[3] & 0x0f)
-        if error != 0:
-            raise RuntimeError("Error condition %x received during memory read!" % error)
         num_bytes_received = ((report[3] >> 4) & 0x0f) + 1
-        data_bytes = report[6:][:num_bytes_received]
-        self._reply_buffer += data_bytes
-        self._bytes_remaining -= num_bytes_received
-        if self._bytes_remaining < 0:
-            raise RuntimeError("Memory read received more data than requested!")
-        elif self._bytes_remaining == 0:
-            self._request_in_progress = False
+        address = (report[4] << 8) + report[5]
+        result = exception = None
+        with self._lock:
+            request = self._find_read(address, error)
+            if request is None:
+                _debug("unexpected memory read reply for address %x" % address)
+                return
+            if error != 0:
+                exception = RuntimeError("Error condition %x received during memory read!" % error)
+            else:
+                request.data += report[6:6 + num_bytes_received]
+                if len(request.data) > request.amount:
+                    exception = RuntimeError("Memory read received more data than requested!")
+                elif len(request.data) == request.amount:
+                    result = request.data
+            if exception is not None or result is not None:
+                self._finish_read(request)
+                self._send_queued_reads()
+        # resolve outside of the lock, done-callbacks may start new reads
+        if exception is not None:
+            request.future.set_exception(exception)
+        elif result is not None:
+            request.future.set_result(result)
 
 
-class CommunicationHandler(threading.Thread):
+# ################### batch decoding ###################### #
 
-    MODE_DEFAULT = 0x30
-    MODE_ACC = 0x31
-    MODE_ACC_IR = 0x33
+REPORT_LENGTH = 22  # report ID + 21 payload bytes (longest data report)
 
-    RPT_STATUS_REQ = 0x15
+REPORT_DTYPE = np.dtype([('timestamp', np.float64),
+                         ('report_id', np.uint8),
+                         ('buttons', np.uint16),
+                         ('ax', np.uint16),
+                         ('ay', np.uint16),
+                         ('az', np.uint16),
+                         ('ir_x', np.uint16, (4,)),
+                         ('ir_y', np.uint16, (4,)),
+                         ('ir_size', np.uint8, (4,)),
+                         ('ir_valid', np.bool_, (4,))])
 
-    def __init__(self, wiimote):
-        threading.Thread.__init__(self)
-        self.daemon = True
-        self.rumble = False  # rumble always
-        self.wiimote = wiimote
-        self.btaddr = wiimote.btaddr
-        self.model = wiimote.model
-        self.reporting_mode = self.MODE_DEFAULT
+# reports with 10 bit accelerometer data in bytes 3-5
+_ACC_LAYOUT_REPORTS = [0x31, 0x33, 0x35, 0x37]
+
+# (report ID, offset of IR data within the report, IR mode)
+_IR_LAYOUTS = [(0x33, 6, IRCam.MODE_EXTENDED),
+               (0x36, 3, IRCam.MODE_BASIC),
+               (0x37, 6, IRCam.MODE_BASIC)]
+
+
+def _reports_to_array(reports):
+    """
+    Turns `reports` into an (N, REPORT_LENGTH) uint8 array.
+    `reports` may be a bytes-like buffer of N back-to-back reports of
+    REPORT_LENGTH bytes each, a 2D uint8 array, or a sequence of single reports.
+    Shorter reports are zero-padded, longer ones are truncated.
+    """
+    if isinstance(reports, np.ndarray):
+        if reports.ndim != 2 or reports.shape[1] != REPORT_LENGTH:
+            raise ValueError("report array needs shape (N, %d)" % REPORT_LENGTH)
+        return reports.astype(np.uint8, copy=False)
+    if isinstance(reports, (bytes, bytearray, memoryview)):
+        raw = np.frombuffer(reports, dtype=np.uint8)
+        if len(raw) % REPORT_LENGTH != 0:
+            raise ValueError("buffer length needs to be a multiple of %d bytes" % REPORT_LENGTH)
+        return raw.reshape(-1, REPORT_LENGTH)
+    padded = b''.join(bytes(report[:REPORT_LENGTH]).ljust(REPORT_LENGTH, b'\x00')
+                      for report in reports)
+    return np.frombuffer(padded, dtype=np.uint8).reshape(-1, REPORT_LENGTH)
+
+
+def _decode_ir_extended(ir_bytes):
+    """
+    Decodes an (N, 12) array of extended-mode IR data into x, y, size arrays of shape (N, 4).
+    """
+    data = ir_bytes.reshape(-1, 4, 3).astype(np.uint16)
+    x = data[:, :, 0] | ((data[:, :, 2] & 0b00110000) << 4)
+    y = data[:, :, 1] | ((data[:, :, 2] & 0b11000000) << 2)
+    size = data[:, :, 2] & 0b00001111
+    return x, y, size
+
+
+def _decode_ir_basic(ir_bytes):
+    """
+    Decodes an (N, 10) array of basic-mode IR data into x, y, size arrays of shape (N, 4).
+    Basic mode does not transmit blob sizes, so size is always 0.
+    """
+    data = ir_bytes.reshape(-1, 2, 5).astype(np.uint16)
+    x = np.empty((len(data), 4), dtype=np.uint16)
+    y = np.empty((len(data), 4), dtype=np.uint16)
+    x[:, 0::2] = data[:, :, 0] | ((data[:, :, 2] & 0b00110000) << 4)
+    y[:, 0::2] = data[:, :, 1] | ((data[:, :, 2] & 0b11000000) << 2)
+    x[:, 1::2] = data[:, :, 3] | ((data[:, :, 2] & 0b00000011) << 8)
+    y[:, 1::2] = data[:, :, 4] | ((data[:, :, 2] & 0b00001100) << 6)
+    return x, y, np.zeros((len(data), 4), dtype=np.uint8)
+
+
+def decode_reports(reports, timestamps=None):
+    """
+    Decodes many Wiimote input reports at once and returns a structured
+    NumPy array with dtype REPORT_DTYPE (one row per report).
+    Each report starts with the report ID, i.e. it has the same format
+    as the reports passed to the sensors' handle_report() methods.
+    Fields that a report type does not carry are left at 0, as are the
+    sensor fields of interleaved reports (0x3e/0x3f).
+    Empty IR slots are reported by the Wiimote at (1023, 1023); `ir_valid`
+    is False for them.
+    `timestamps` optionally provides one receive time per report.
+    """
+    raw = _reports_to_array(reports)
+    out = np.zeros(len(raw), dtype=REPORT_DTYPE)
+    if timestamps is not None:
+        out['timestamp'] = timestamps
+    rpt_type = raw[:, 0]
+    out['report_id'] = rpt_type
+    b1 = raw[:, 1].astype(np.uint16)
+    b2 = raw[:, 2].astype(np.uint16)
+    out['buttons'] = ((b1 << 8) | b2) & Buttons.MASK
+    has_acc = np.isin(rpt_type, _ACC_LAYOUT_REPORTS)
+    if has_acc.any():
+        acc = raw[has_acc].astype(np.uint16)
+        out['ax'][has_acc] = (acc[:, 3] << 2) | ((acc[:, 1] & 0b01100000) >> 5)
+        out['ay'][has_acc] = (acc[:, 4] << 2) | ((acc[:, 2] & 0b00100000) >> 4)
+        out['az'][has_acc] = (acc[:, 5] << 2) | ((acc[:, 2] & 0b01000000) >> 5)
+    for rpt, offset, mode in _IR_LAYOUTS:
+        has_ir = rpt_type == rpt
+        if not has_ir.any():
+            continue
+        if mode == IRCam.MODE_EXTENDED:
+            x, y, size = _decode_ir_extended(raw[has_ir, offset:offset + 12])
+        else:
+            x, y, size = _decode_ir_basic(raw[has_ir, offset:offset + 10])
+        out['ir_x'][has_ir] = x
+        out['ir_y'][has_ir] = y
+        out['ir_size'][has_ir] = size
+        out['ir_valid'][has_ir] = y != 0x3ff
+    return out
+
+# ########################################################### #
+
+
+# ################### transports ########################## #
+
+class Transport(object):
+    """
+    Base class for the connection to a Wiimote.
+    A transport delivers input reports (including the 0xa1 header byte)
+    via recv() and sends output reports via send().
+    `CMD_SET_REPORT` is the header byte that precedes every output report.
+    """
+
+    CMD_SET_REPORT = 0xa2
+
+    def send(self, data):
+        raise NotImplementedError()
+
+    def recv(self, bufsize):
+        raise NotImplementedError()
+
+    def recv_into(self, buffer, nbytes=0):
+        """
+        Receive one report into a writable `buffer`, return its length.
+        Transports that can receive without allocating should override this.
+        """
+        data = self.recv(nbytes or len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def settimeout(self, timeout):
+        raise NotImplementedError()
+
+    def fileno(self):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class BluetoothTransport(Transport):
+    """
+    L2CAP connection to a physical Wiimote: control channel on PSM 17,
+    data channel on PSM 19.
+    """
+
+    def __init__(self, btaddr, model):
+        _require_bluetooth()
         self._controlsocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
-        self._controlsocket.connect((self.btaddr, 17))
+        self._controlsocket.connect((btaddr, 17))
         self._datasocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
-        self._datasocket.connect((self.btaddr, 19))
-        if self.model == 'Nintendo RVL-CNT-01':
+        self._datasocket.connect((btaddr, 19))
+        if model == 'Nintendo RVL-CNT-01':
             self._sendsocket = self._controlsocket
-            self._CMD_SET_REPORT = 0x52
-        elif self.model == 'Nintendo RVL-CNT-01-TR':
+            self.CMD_SET_REPORT = 0x52
+        elif model == 'Nintendo RVL-CNT-01-TR':
             self._sendsocket = self._datasocket
-            self._CMD_SET_REPORT = 0xa2
+            self.CMD_SET_REPORT = 0xa2
         else:
             raise Exception("unknown model")
+
+    def send(self, data):
+        self._sendsocket.send(data)
+
+    def recv(self, bufsize):
+        return self._datasocket.recv(bufsize)
+
+    def recv_into(self, buffer, nbytes=0):
+        if hasattr(self._datasocket, 'recv_into'):
+            return self._datasocket.recv_into(buffer, nbytes)
+        return Transport.recv_into(self, buffer, nbytes)
+
+    def settimeout(self, timeout):
+        self._datasocket.settimeout(timeout)
+
+    def fileno(self):
+        return self._datasocket.fileno()
+
+    def close(self):
+        self._datasocket.close()
+        self._controlsocket.close()
+
+
+if bluetooth is not None:
+    TRANSPORT_ERRORS = (bluetooth.BluetoothError, socket.timeout)
+else:
+    TRANSPORT_ERRORS = (socket.timeout,)
+
+# ########################################################### #
+
+
+# ################### capture / replay #################### #
+
+CAPTURE_MAGIC = b'WIIMCAP1'
+CAPTURE_REPORT_SIZE = 32  # as much as CommunicationHandler.run() receives at once
+_CAPTURE_HEADER = struct.Struct('<qB')  # timestamp in ns, report length
+
+# one record per received report, including the 0xa1 header byte
+CAPTURE_DTYPE = np.dtype([('timestamp_ns', '<i8'),
+                          ('length', 'u1'),
+                          ('data', 'u1', (CAPTURE_REPORT_SIZE,))])
+
+
+class ReportCapture(object):
+    """
+    Appends received reports to a binary capture file.
+    The file starts with CAPTURE_MAGIC, followed by fixed-size records
+    (see CAPTURE_DTYPE): a monotonic timestamp in nanoseconds, the report
+    length and the raw report, zero-padded to CAPTURE_REPORT_SIZE bytes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(CAPTURE_MAGIC)
+        self._record = bytearray(CAPTURE_DTYPE.itemsize)
+        self._padding = memoryview(bytes(CAPTURE_REPORT_SIZE))
+
+    def write(self, report, timestamp_ns=None):
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        length = min(len(report), CAPTURE_REPORT_SIZE)
+        offset = _CAPTURE_HEADER.size
+        _CAPTURE_HEADER.pack_into(self._record, 0, timestamp_ns, length)
+        self._record[offset:offset + length] = report[:length]
+        self._record[offset + length:] = self._padding[length:]
+        with self._lock:
+            if self._file is not None:
+                self._file.write(self._record)
+                self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class ReplaySource(object):
+    """
+    Memory-maps a capture file written by ReportCapture and plays it back.
+    `records` is a NumPy view (dtype CAPTURE_DTYPE) of all records in the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+                raise ValueError("%s is not a Wiimote capture file" % path)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # ignore a partially written record at the end of the file
+        count = (len(self._mmap) - len(CAPTURE_MAGIC)) // CAPTURE_DTYPE.itemsize
+        self.records = np.frombuffer(self._mmap, dtype=CAPTURE_DTYPE, count=count,
+                                     offset=len(CAPTURE_MAGIC))
+        self._generators = weakref.WeakSet()  # unfinished reports() generators
+
+    def __len__(self):
+        return len(self.records)
+
+    def reports(self, speed=1.0):
+        """
+        Yields (timestamp, report) tuples, where timestamp is the original
+        receive time in seconds and report is a memoryview of the raw report.
+        With `speed` 1.0 reports are yielded in real time, with 2.0 twice
+        as fast, and with None as fast as possible.
+        The reports are only valid until the source is closed.
+        """
+        generator = self._reports(speed)
+        self._generators.add(generator)
+        return generator
+
+    def _reports(self, speed):
+        view = memoryview(self._mmap)
+        try:
+            start = time.monotonic()
+            first_ns = int(self.records['timestamp_ns'][0]) if len(self.records) else 0
+            offset = len(CAPTURE_MAGIC) + _CAPTURE_HEADER.size
+            for i in range(len(self.records)):
+                timestamp_ns, length = _CAPTURE_HEADER.unpack_from(
+                    self._mmap, offset - _CAPTURE_HEADER.size)
+                if speed:
+                    delay = start + (timestamp_ns - first_ns) / 1e9 / speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                yield timestamp_ns / 1e9, view[offset:offset + length]
+                offset += CAPTURE_DTYPE.itemsize
+        finally:
+            view.release()
+
+    def play(self, handler, speed=None):
+        """
+        Feeds all reports into the _handle() method of a CommunicationHandler,
+        using the original receive timestamps.
+        Returns the number of reports played.
+        """
+        count = 0
+        for timestamp, report in self.reports(speed):
+            handler._handle(report, timestamp)
+            count += 1
+        return count
+
+    def decode(self):
+        """
+        Decodes all captured reports at once, see decode_reports().
+        """
+        data = self.records['data'][:, 1:REPORT_LENGTH + 1]
+        return decode_reports(data, self.records['timestamp_ns'] / 1e9)
+
+    def close(self):
+        """
+        Stops all running reports() generators and unmaps the file.
+        """
+        for generator in list(self._generators):
+            generator.close()
+        self.records = None
+        self._mmap.close()
+
+
+class ReplayTransport(Transport):
+    """
+    Transport that delivers the reports of a capture file instead of a
+    live connection. Output reports are discarded.
+    Signals a disconnect once all reports have been delivered.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self._source = ReplaySource(path)
+        self._reports = self._source.reports(speed)
+
+    def send(self, data):
+        pass
+
+    def recv(self, bufsize):
+        for timestamp, report in self._reports:
+            return bytes(report[:bufsize])
+        return b''
+
+    def settimeout(self, timeout):
+        pass
+
+    def close(self):
+        self._reports.close()
+        self._source.close()
+
+# ########################################################### #
+
+
+# ################### output reports ###################### #
+
+class ReportEncoder(object):
+    """
+    Encodes output reports into one preallocated buffer per report ID.
+    Each report type has a fixed struct layout for its header fields,
+    optionally followed by a zero-padded data block of fixed size.
+    The returned buffer is reused for the next report of the same type,
+    so it has to be sent before encode() is called again.
+    """
+
+    RPT_RUMBLE = 0x10
+    RPT_LED = 0x11
+    RPT_REPORT_MODE = 0x12
+    RPT_IR_ENABLE = 0x13
+    RPT_SPKR_ENABLE = 0x14
+    RPT_STATUS_REQ = 0x15
+    RPT_WRITE = 0x16
+    RPT_READ = 0x17
+    RPT_SPKR_DATA = 0x18
+    RPT_SPKR_MUTE = 0x19
+    RPT_IR_ENABLE2 = 0x1a
+
+    # report ID -> (layout of fields after the report ID, size of data block)
+    LAYOUTS = {
+        RPT_RUMBLE: (struct.Struct('>B'), 0),
+        RPT_LED: (struct.Struct('>B'), 0),
+        RPT_REPORT_MODE: (struct.Struct('>BB'), 0),  # flags, mode
+        RPT_IR_ENABLE: (struct.Struct('>B'), 0),
+        RPT_SPKR_ENABLE: (struct.Struct('>B'), 0),
+        RPT_STATUS_REQ: (struct.Struct('>B'), 0),
+        RPT_WRITE: (struct.Struct('>BBHB'), 16),  # space, address (24 bit), size, data
+        RPT_READ: (struct.Struct('>BBHH'), 0),  # space, address (24 bit), size
+        RPT_SPKR_DATA: (struct.Struct('>B'), 20),  # length << 3, data
+        RPT_SPKR_MUTE: (struct.Struct('>B'), 0),
+        RPT_IR_ENABLE2: (struct.Struct('>B'), 0),
+    }
+
+    def __init__(self, cmd_set_report):
+        self._buffers = {}
+        self._padding = memoryview(bytes(max(size for _, size in self.LAYOUTS.values())))
+        for rpt, (layout, data_size) in self.LAYOUTS.items():
+            buf = bytearray(2 + layout.size + data_size)
+            buf[0] = cmd_set_report
+            buf[1] = rpt
+            self._buffers[rpt] = buf
+
+    @classmethod
+    def check(cls, rpt, fields, data=None):
+        """
+        Raises a ValueError if `fields` or `data` do not fit report `rpt`,
+        so that errors surface where a report is queued, not where it is sent.
+        """
+        layout, data_size = cls.LAYOUTS[rpt]
+        try:
+            layout.pack(*fields)
+        except struct.error as e:
+            raise ValueError("invalid fields %s for report 0x%02x: %s" % (fields, rpt, e))
+        if data_size:
+            if len(data) > data_size:
+                raise ValueError("report 0x%02x carries at most %d data bytes" % (rpt, data_size))
+            if not isinstance(data, (bytes, bytearray)):
+                bytes(data)  # raises a ValueError for values outside 0..255
+
+    def encode(self, rpt, rumble, fields, data=None):
+        """
+        Returns the buffer for report `rpt` filled with `fields` and `data`.
+        The rumble bit is set in the first payload byte if `rumble` is True.
+        """
+        layout, data_size = self.LAYOUTS[rpt]
+        buf = self._buffers[rpt]
+        layout.pack_into(buf, 2, *fields)
+        if data_size:
+            offset = 2 + layout.size
+            length = len(data)
+            if length > data_size:
+                raise ValueError("report 0x%02x carries at most %d data bytes" % (rpt, data_size))
+            buf[offset:offset + length] = data
+            buf[offset + length:] = self._padding[:data_size - length]
+        if rumble:
+            buf[2] |= 0x01
+        return buf
+
+# ########################################################### #
+
+
+# ################### instrumentation ###################### #
+
+class Histogram(object):
+    """
+    Counts values in fixed buckets. `bounds` are the inclusive upper bounds
+    of all but the last bucket, which is unbounded.
+    """
+
+    # microseconds
+    DURATION_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000, 100000)
+    INTERVAL_BOUNDS = (100, 500, 1000, 2000, 4000, 6000, 8000, 9000, 10000, 11000, 12000,
+                       15000, 20000, 30000, 50000, 100000, 250000, 1000000)
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def add_many(self, values):
+        """
+        Adds all values of the numpy array `values`.
+        """
+        if not len(values):
+            return
+        counts = np.bincount(np.searchsorted(self.bounds, values, side='left'),
+                             minlength=len(self.counts))
+        for i, count in enumerate(counts.tolist()):
+            self.counts[i] += count
+        self.count += len(values)
+        self.sum += float(np.sum(values))
+        self.max = max(self.max, float(np.max(values)))
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket containing the `q` quantile
+        (the maximum value for the last bucket).
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return float(min(bound, self.max))
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.sum / self.count if self.count else 0.0,
+                'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99),
+                'max': self.max}
+
+
+class ReportStats(object):
+    """
+    Timing statistics of the reports received by a CommunicationHandler.
+
+    The receive thread only counts reports and stores the arrival times of
+    data reports (0x30-0x3f) in a ring buffer of HISTORY entries; intervals,
+    jitter and gaps are evaluated in update(), i.e. when the statistics are
+    read. Read them at least every HISTORY reports (e.g. every 80 s at
+    100 Hz) to cover all reports.
+
+    The Wiimote does not number its reports, so lost reports are estimated:
+    a gap is an interval of more than GAP_FACTOR times the median interval.
+    Pauses longer than IDLE_INTERVAL, e.g. in non-continuous reporting
+    modes, are not counted as gaps.
+    Jitter is the mean absolute difference between consecutive intervals.
+    """
+
+    HISTORY = 8192  # power of two
+    GAP_FACTOR = 2.5
+    IDLE_INTERVAL = 1.0  # s
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.reports = [0] * 256  # per report ID
+        self.arrivals = array.array('d', bytes(8 * self.HISTORY))
+        self.arrival_count = 0  # data reports received; written by the receive thread only
+        self.interval = Histogram(Histogram.INTERVAL_BOUNDS)
+        self.jitter = 0.0  # us
+        self.gaps = 0
+        self.lost = 0
+        self.decode = {}  # sensor name -> Histogram
+        self._decode_names = {}  # decoder -> sensor name
+        self._evaluated = 0
+        self._jitter_sum = 0.0
+        self._jitter_count = 0
+        self._lock = threading.Lock()
+
+    def add_decode(self, decoder, duration):
+        name = self._decode_names.get(decoder)
+        if name is None:
+            name = type(getattr(decoder, '__self__', decoder)).__name__.lower()
+            self._decode_names[decoder] = name
+            self.decode[name] = Histogram(Histogram.DURATION_BOUNDS)
+        self.decode[name].add(duration)
+
+    def update(self):
+        """
+        Evaluates the arrival times recorded since the last call.
+        """
+        with self._lock:
+            end = self.arrival_count
+            start = max(self._evaluated - 1, end - self.HISTORY, 0)
+            self._evaluated = end
+            if end - start < 2:
+                return
+            ring = np.frombuffer(self.arrivals, dtype=np.float64)
+            times = ring[np.arange(start, end) & (self.HISTORY - 1)]
+            intervals = np.diff(times) * 1e6
+            intervals = intervals[intervals >= 0]  # overwritten while reading
+            self.interval.add_many(intervals)
+            intervals = intervals[intervals <= self.IDLE_INTERVAL * 1e6]
+            if len(intervals) < 2:
+                return
+            median = np.median(intervals)
+            gaps = intervals > self.GAP_FACTOR * median
+            self.gaps += int(np.count_nonzero(gaps))
+            self.lost += int(np.sum(np.round(intervals[gaps] / median) - 1))
+            regular = intervals[~gaps]
+            if len(regular) > 1:
+                self._jitter_sum += float(np.sum(np.abs(np.diff(regular))))
+                self._jitter_count += len(regular) - 1
+                self.jitter = self._jitter_sum / self._jitter_count
+
+    def as_dict(self):
+        self.update()
+        elapsed = time.monotonic() - self.started
+        total = sum(self.reports)
+        return {'reports': total,
+                'reports_per_s': total / elapsed if elapsed > 0 else 0.0,
+                'report_ids': dict(('0x%02x' % rpt, count)
+                                   for rpt, count in enumerate(self.reports) if count),
+                'interval_us': self.interval.summary(),
+                'jitter_us': self.jitter,
+                'gaps': self.gaps,
+                'lost': self.lost,
+                'decode_us': dict((name, hist.summary()) for name, hist in self.decode.items())}
+
+
+def _prometheus_histogram(lines, name, labels, hist):
+    cumulative = 0
+    for bound, count in zip(hist.bounds, hist.counts):
+        cumulative += count
+        lines.append('%s_bucket{%s,le="%g"} %d' % (name, labels, bound * 1e-6, cumulative))
+    lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, hist.count))
+    lines.append('%s_sum{%s} %g' % (name, labels, hist.sum * 1e-6))
+    lines.append('%s_count{%s} %d' % (name, labels, hist.count))
+
+
+def prometheus_text(wiimotes):
+    """
+    Returns the statistics of all `wiimotes` in the Prometheus text
+    exposition format. Times are converted to seconds.
+    """
+    lines = ['# TYPE wiimote_reports_total counter',
+             '# TYPE wiimote_report_interval_seconds histogram',
+             '# TYPE wiimote_jitter_seconds gauge',
+             '# TYPE wiimote_gaps_total counter',
+             '# TYPE wiimote_lost_reports_total counter',
+             '# TYPE wiimote_decode_seconds histogram',
+             '# TYPE wiimote_callback_latency_seconds histogram',
+             '# TYPE wiimote_callback_pending gauge',
+             '# TYPE wiimote_callback_dropped_total counter',
+             '# TYPE wiimote_output_queue_depth gauge',
+             '# TYPE wiimote_output_reports_total counter',
+             '# TYPE wiimote_output_coalesced_total counter',
+             '# TYPE wiimote_output_delay_seconds histogram']
+    for wm in wiimotes:
+        stats = wm._com.stats
+        stats.update()
+        device = 'btaddr="%s"' % wm.btaddr
+        for rpt, count in enumerate(stats.reports):
+            if count:
+                lines.append('wiimote_reports_total{%s,report="0x%02x"} %d' % (device, rpt, count))
+        _prometheus_histogram(lines, 'wiimote_report_interval_seconds', device, stats.interval)
+        lines.append('wiimote_jitter_seconds{%s} %g' % (device, stats.jitter * 1e-6))
+        lines.append('wiimote_gaps_total{%s} %d' % (device, stats.gaps))
+        lines.append('wiimote_lost_reports_total{%s} %d' % (device, stats.lost))
+        for name, hist in stats.decode.items():
+            _prometheus_histogram(lines, 'wiimote_decode_seconds', '%s,sensor="%s"' % (device, name), hist)
+        for sensor, subscriptions in wm._subscriptions():
+            for i, subscription in enumerate(subscriptions):
+                labels = '%s,sensor="%s",subscriber="%d"' % (device, sensor, i)
+                _prometheus_histogram(lines, 'wiimote_callback_latency_seconds', labels,
+                                      subscription.latency)
+                lines.append('wiimote_callback_pending{%s} %d' % (labels, subscription.pending()))
+                lines.append('wiimote_callback_dropped_total{%s} %d' % (labels, subscription.dropped))
+        with wm._writer._cond:
+            output = wm._writer._channel(wm._com)
+            lines.append('wiimote_output_queue_depth{%s} %d' % (device, output.depth))
+            lines.append('wiimote_output_reports_total{%s} %d' % (device, output.sent))
+            lines.append('wiimote_output_coalesced_total{%s} %d' % (device, output.coalesced))
+            _prometheus_histogram(lines, 'wiimote_output_delay_seconds', device, output.delay)
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(object):
+    """
+    Serves prometheus_text() at http://host:port/metrics from a
+    background thread. `source` is a WiimoteManager, a WiiMote or a list
+    of WiiMotes. Binds to localhost unless another `host` is given.
+    """
+
+    def __init__(self, source, port=9464, host='127.0.0.1'):
+        self.source = source
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = prometheus_text(server.wiimotes()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                _debug("metrics: " + format % args)
+
+        self._httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="MetricsServer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wiimotes(self):
+        if isinstance(self.source, WiiMote):
+            return [self.source]
+        return list(getattr(self.source, 'wiimotes', self.source))
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+# ########################################################### #
+
+
+# ################### output ###################### #
+
+class _OutputChannel(object):
+    """
+    Output state and statistics of one device within an OutputWriter.
+    """
+
+    def __init__(self, com):
+        self.com = com
+        self.rumble = False  # rumble bit sent with every report
+        self.pending = {}  # report ID -> queued entry that a newer report of that ID supersedes
+        self.depth = 0
+        self.max_depth = 0
+        self.queued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.delay = Histogram(Histogram.DURATION_BOUNDS)  # us from queueing to sending
+        self.started = time.monotonic()
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {'depth': self.depth,
+                'max_depth': self.max_depth,
+                'queued': self.queued,
+                'sent': self.sent,
+                'sent_per_s': self.sent / elapsed if elapsed > 0 else 0.0,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'delay_us': self.delay.summary()}
+
+
+class OutputWriter(threading.Thread):
+    """
+    Sends the output reports of one or more Wiimotes from a single thread,
+    so reports from different threads never interleave on a connection.
+
+    Reports are queued with a priority derived from their report ID:
+    rumble and LED changes first, then memory access and other control
+    reports, then speaker data. Reports of equal priority are sent in the
+    order they were queued; speaker data can carry a deadline (a
+    time.monotonic() value) before which it is not sent.
+    A rumble, LED or report mode report that is queued while an older
+    report with the same ID is still waiting replaces that older report.
+    The rumble bit is part of the writer's state (see set_rumble()) and is
+    added to each report when it is sent.
+    """
+
+    ACTUATOR, CONTROL, AUDIO = 0, 1, 2
+
+    PRIORITIES = {ReportEncoder.RPT_RUMBLE: ACTUATOR,
+                  ReportEncoder.RPT_LED: ACTUATOR,
+                  ReportEncoder.RPT_SPKR_DATA: AUDIO}  # all others: CONTROL
+    COALESCED = (ReportEncoder.RPT_RUMBLE, ReportEncoder.RPT_LED, ReportEncoder.RPT_REPORT_MODE)
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="OutputWriter")
+        self.daemon = True
+        self.running = False
+        self._thread_started = False
+        self._cond = threading.Condition()
+        self._channels = {}  # CommunicationHandler -> _OutputChannel
+        # (priority, deadline or 0, sequence number,
+        #  [channel, rpt, fields, data, queued, histogram, on_error])
+        self._heap = []
+        self._sequence = itertools.count()
+        self._sending = None  # channel whose report is being sent
+
+    def _channel(self, com):
+        channel = self._channels.get(com)
+        if channel is None:
+            channel = self._channels[com] = _OutputChannel(com)
+        return channel
+
+    def put(self, com, rpt, fields, data=None, deadline=None, histogram=None, on_error=None):
+        """
+        Queues report `rpt` for device `com`, see ReportEncoder.encode().
+        If `rpt` is None, `data` is a complete raw report.
+        The lateness of reports with a `deadline` is added to `histogram`
+        (in us) when they are sent. If the report can not be sent,
+        `on_error` is called with the exception on the writer thread.
+        """
+        priority = self.PRIORITIES.get(rpt, self.CONTROL)
+        entry = [None, rpt, fields, data, time.monotonic(), histogram, on_error]
+        with self._cond:
+            channel = entry[0] = self._channel(com)
+            if rpt in self.COALESCED:
+                superseded = channel.pending.get(rpt)
+                if superseded is not None:
+                    superseded[0] = None
+                    channel.depth -= 1
+                    channel.coalesced += 1
+                channel.pending[rpt] = entry
+            heapq.heappush(self._heap, (priority, deadline or 0.0, next(self._sequence), entry))
+            channel.queued += 1
+            channel.depth += 1
+            if channel.depth > channel.max_depth:
+                channel.max_depth = channel.depth
+            if not self._thread_started:
+                self._thread_started = self.running = True
+                self.start()
+            self._cond.notify()
+
+    def set_rumble(self, com, state):
+        """
+        Sets the rumble bit of all reports sent to `com` from now on.
+        """
+        with self._cond:
+            self._channel(com).rumble = bool(state)
+
+    def get_rumble(self, com):
+        channel = self._channels.get(com)
+        return channel is not None and channel.rumble
+
+    def flush(self, com, timeout=None):
+        """
+        Waits until all reports queued for `com` have been sent.
+        Returns False on timeout.
+        """
+        with self._cond:
+            channel = self._channels.get(com)
+            if channel is None:
+                return True
+            return self._cond.wait_for(
+                lambda: not self.running or (channel.depth == 0 and self._sending is not channel),
+                timeout)
+
+    def stats(self, com):
+        with self._cond:
+            return self._channel(com).as_dict()
+
+    def remove(self, com):
+        """
+        Forgets device `com` and discards its queued reports.
+        """
+        with self._cond:
+            channel = self._channels.pop(com, None)
+            if channel is None:
+                return
+            for _, _, _, entry in self._heap:
+                if entry[0] is channel:
+                    entry[0] = None
+            channel.depth = 0
+            channel.pending.clear()
+            self._cond.notify_all()
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+
+    def _next(self):
+        """
+        Waits for the next report that is due and returns its entry and
+        rumble bit, or None once stopped. Must be called with self._cond held.
+        """
+        heap = self._heap
+        while self.running:
+            if not heap:
+                self._cond.wait()
+                continue
+            priority, deadline, _, entry = heap[0]
+            channel = entry[0]
+            if channel is None:
+                heapq.heappop(heap)
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout > 0:
+                self._cond.wait(timeout)
+                continue
+            heapq.heappop(heap)
+            channel.depth -= 1
+            if channel.pending.get(entry[1]) is entry:
+                del channel.pending[entry[1]]
+            self._sending = channel
+            return entry, deadline, channel.rumble
+        return None
+
+    def run(self):
+        clock = time.monotonic
+        while True:
+            with self._cond:
+                self._sending = None
+                self._cond.notify_all()  # wake up flush()
+                item = self._next()
+            if item is None:
+                return
+            (channel, rpt, fields, data, queued, histogram, on_error), deadline, rumble = item
+            com = channel.com
+            try:
+                if rpt is None:
+                    report = bytearray(data)
+                    if rumble:
+                        report[2] |= 0x01
+                else:
+                    report = com._encoder.encode(rpt, rumble, fields, data)
+                com._transport.send(report)
+            except Exception as e:  # the writer thread serves all devices, keep it running
+                _debug("could not send report to %s: %s" % (com.btaddr, e))
+                channel.errors += 1
+                if on_error is not None:
+                    on_error(e)
+                continue
+            now = clock()
+            channel.sent += 1
+            if deadline:
+                if histogram is not None:
+                    histogram.add(max(now - deadline, 0.0) * 1e6)
+            else:
+                channel.delay.add((now - queued) * 1e6)
+
+# ########################################################### #
+
+
+class CommunicationHandler(threading.Thread):
+
+    MODE_DEFAULT = 0x30
+    MODE_ACC = 0x31
+    MODE_ACC_IR = 0x33
+
+    # (accelerometer active, IR mode or None) -> smallest data reporting mode
+    REPORT_MODES = {(False, None): 0x30,
+                    (True, None): 0x31,
+                    (False, IRCam.MODE_BASIC): 0x36,
+                    (True, IRCam.MODE_BASIC): 0x37,
+                    (False, IRCam.MODE_EXTENDED): 0x33,
+                    (True, IRCam.MODE_EXTENDED): 0x33,
+                    (False, IRCam.MODE_FULL): 0x3e,
+                    (True, IRCam.MODE_FULL): 0x3e}
+
+    RPT_STATUS_REQ = 0x15
+
+    MAX_REPORT_SIZE = 32
+    MAX_DRAIN = 64  # max. number of queued reports handled per wake-up
+
+    def __init__(self, wiimote, transport=None, writer=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.wiimote = wiimote
+        self.btaddr = wiimote.btaddr
+        self.model = wiimote.model
+        self.reporting_mode = None
+        self.continuous = False
+        self.auto_report_mode = False  # enabled by WiiMote once all sensors exist
+        self._mode_lock = threading.RLock()
+        if transport is None:
+            transport = BluetoothTransport(self.btaddr, self.model)
+        self._transport = transport
+        self._CMD_SET_REPORT = transport.CMD_SET_REPORT
+        self._encoder = ReportEncoder(self._CMD_SET_REPORT)  # used by the writer thread only
+        self._writer = writer if writer is not None else OutputWriter()
+        self._capture = None
+        self._recv_buffer = bytearray(self.MAX_REPORT_SIZE)
+        self._recv_view = memoryview(self._recv_buffer)
+        self._wakeup_lock = threading.Lock()  # guards closing the wake-up pipe
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._decoders = []
+        self._dispatch = [()] * 256
+        self._receiver = None  # _ReceiveThread of a WiimoteManager, if any
+        self.stats = ReportStats()
+        self.timing = False  # measure decode times, see WiiMote.set_timing()
         try:
-            self._datasocket.settimeout(1)
+            self._transport.settimeout(1)
         except NotImplementedError:
             print("socket timeout not implemented with this bluetooth module")
-        self.set_report_mode(self.MODE_ACC_IR)
+
+    @property
+    def rumble(self):
+        return self._writer.get_rumble(self)
 
     def _send(self, *bytes_to_send, signed=False):
+        """
+        Queues an arbitrary report given as (nested lists of) byte values.
+        Prefer the typed send_*() methods, which do not allocate.
+        """
         _debug("sending " + str(bytes_to_send))
-        data_str = self._CMD_SET_REPORT.to_bytes(1, 'big')
         bytes_to_send = _flatten(bytes_to_send)
-        bytes_to_send[1] |= int(self.rumble)
-        for b in bytes_to_send:
-            data_str += b.to_bytes(1, 'big', signed=signed)
-        self._sendsocket.send(data_str)
+        if len(bytes_to_send) < 2:
+            raise ValueError("a report needs a report ID and at least one payload byte")
+        data = bytes([self._CMD_SET_REPORT]) + b''.join(
+            b.to_bytes(1, 'big', signed=signed) for b in bytes_to_send)
+        self._writer.put(self, None, None, data)
+
+    def _send_report(self, rpt, fields, data=None, deadline=None, histogram=None, on_error=None):
+        """
+        Queues a report for the OutputWriter. All output goes through
+        the writer thread, so this returns before the report is sent;
+        invalid fields or data raise a ValueError here, though.
+        """
+        if DEBUG:
+            _debug("sending report 0x%02x %s" % (rpt, str(fields)))
+        ReportEncoder.check(rpt, fields, data)
+        self._writer.put(self, rpt, fields, data, deadline, histogram, on_error)
+
+    def flush(self, timeout=None):
+        """
+        Waits until all queued output reports have been sent.
+        Returns False on timeout.
+        """
+        return self._writer.flush(self, timeout)
+
+    def output_stats(self):
+        """
+        Returns depth, sent reports, send rate and queueing delay of the
+        output queue.
+        """
+        return self._writer.stats(self)
+
+    def send_leds(self, led_byte, rumble=None):
+        """
+        Sends the LED state. If `rumble` is given, the rumble bit is
+        changed together with the LEDs.
+        """
+        if rumble is not None:
+            self._writer.set_rumble(self, rumble)
+        self._send_report(ReportEncoder.RPT_LED, (led_byte,))
+
+    def send_ir_enable(self, enabled):
+        flag = 0x04 if enabled else 0x00
+        self._send_report(ReportEncoder.RPT_IR_ENABLE, (flag,))
+        self._send_report(ReportEncoder.RPT_IR_ENABLE2, (flag,))
+
+    def send_speaker_enable(self, enabled):
+        self._send_report(ReportEncoder.RPT_SPKR_ENABLE, (0x04 if enabled else 0x00,))
+
+    def send_speaker_mute(self, muted):
+        self._send_report(ReportEncoder.RPT_SPKR_MUTE, (0x04 if muted else 0x00,))
+
+    def send_speaker_data(self, data, deadline=None, histogram=None):
+        """
+        Sends up to 20 bytes of audio data, not before `deadline` if given
+        (see OutputWriter.put()).
+        """
+        self._send_report(ReportEncoder.RPT_SPKR_DATA, (len(data) << 3,), data, deadline, histogram)
+
+    def send_memory_write(self, address, data, eeprom=False):
+        """
+        Sends a single write report with up to 16 bytes of `data`.
+        """
+        control_or_eeprom = 0x00 if eeprom else 0x04
+        self._send_report(ReportEncoder.RPT_WRITE,
+                          (control_or_eeprom, (address >> 16) & 0xff, address & 0xffff, len(data)),
+                          data)
+
+    def send_memory_read(self, address, amount, eeprom=False, on_error=None):
+        """
+        Sends a read request for `amount` bytes. `on_error` is called with
+        the exception if the request can not be sent.
+        """
+        control_or_eeprom = 0x00 if eeprom else 0x04
+        self._send_report(ReportEncoder.RPT_READ,
+                          (control_or_eeprom, (address >> 16) & 0xff, address & 0xffff, amount),
+                          on_error=on_error)
 
     def run(self):
         self.running = True
-        while self.running:
-            try:
-                data = self._datasocket.recv(32)
-            except bluetooth.BluetoothError:
-                _debug("BluetoothError while waiting for data")
-                continue
-            if len(data) < 2:  # disconnect!
-                self.running = False
-            else:
-                self._handle(data)
-            time.sleep(0.001)  # Wiimote: 100 Hz, check ten times as often
+        try:
+            fileno = self._transport.fileno()
+        except NotImplementedError:
+            fileno = None
+        if fileno is None:
+            while self.running:
+                self._receive()
+        else:
+            self._run_poll(fileno)
         self._dispose()
 
+    def _run_poll(self, fileno):
+        """
+        Waits for data or for a wake-up from stop() with poll() and then
+        drains all reports that are queued on the transport.
+        """
+        poller = select.poll()
+        poller.register(fileno, select.POLLIN)
+        poller.register(self._wakeup_r, select.POLLIN)
+        data_ready = select.poll()
+        data_ready.register(fileno, select.POLLIN)
+        while self.running:
+            for fd, event in poller.poll():
+                if fd == self._wakeup_r:
+                    os.read(self._wakeup_r, 64)
+                    continue
+                if event & (select.POLLHUP | select.POLLERR | select.POLLNVAL) \
+                   and not event & select.POLLIN:
+                    self.running = False
+                    break
+                for _ in range(self.MAX_DRAIN):
+                    if not self._receive() or not data_ready.poll(0):
+                        break
+
+    def _receive(self):
+        """
+        Receives one report into the reusable receive buffer and handles it.
+        Returns False if the connection has been closed.
+        """
+        try:
+            length = self._transport.recv_into(self._recv_buffer, self.MAX_REPORT_SIZE)
+        except TRANSPORT_ERRORS:
+            _debug("transport error while waiting for data")
+            return True
+        except OSError:
+            length = 0
+        if length < 2:  # disconnect!
+            self.running = False
+            return False
+        self._handle(self._recv_view[:length])
+        return True
+
+    def is_receiving(self):
+        """
+        Returns True while reports are being received, either by this
+        thread or by the receive thread of a WiimoteManager.
+        """
+        if self._receiver is not None:
+            return self.running and self._receiver.is_alive()
+        return self.is_alive()
+
+    def on_receive_thread(self):
+        """
+        Returns True if called from the thread that handles incoming reports.
+        """
+        return threading.current_thread() is (self._receiver or self)
+
+    def stop(self):
+        """
+        Stops the receive loop and closes the connection.
+        """
+        self.running = False
+        if self._receiver is not None:
+            self._receiver.wakeup()
+            return
+        with self._wakeup_lock:
+            if self._wakeup_w is not None:  # not yet disposed
+                os.write(self._wakeup_w, b'\x00')
+
     def _dispose(self):
-        self._datasocket.close()
-        self._controlsocket.close()
+        self._transport.close()
         self.running = False
+        with self._wakeup_lock:
+            if self._wakeup_w is not None:
+                os.close(self._wakeup_r)
+                os.close(self._wakeup_w)
+                self._wakeup_r = self._wakeup_w = None
+
+    def set_report_mode(self, mode, continuous=None):
+        """
+        Sets a fixed data reporting mode and turns off the automatic mode
+        selection (see select_report_mode()). Unless `continuous` is given,
+        the Wiimote sends reports continuously in all modes but 0x30.
+        """
+        self.auto_report_mode = False
+        self._send_report_mode(mode, continuous)
+        self.update_dispatch()
+
+    def _send_report_mode(self, mode, continuous=None):
+        if continuous is None:
+            continuous = mode != self.MODE_DEFAULT
+        with self._mode_lock:
+            if (mode, continuous) == (self.reporting_mode, self.continuous):
+                return
+            self.reporting_mode = mode
+            self.continuous = continuous
+            self._send_report(ReportEncoder.RPT_REPORT_MODE, (0x04 if continuous else 0x00, mode))
+
+    def select_report_mode(self):
+        """
+        Switches to the smallest data reporting mode that carries the data
+        of all active sensors (see REPORT_MODES) and powers the IR camera
+        on or off. With only the buttons in use, the Wiimote reports
+        changes only (mode 0x30, non-continuous).
+        Called whenever sensors gain or lose subscribers while
+        `auto_report_mode` is set.
+        """
+        if not self.auto_report_mode:
+            return
+        wiimote = self.wiimote
+        with self._mode_lock:
+            ir_mode = wiimote.ir.update_camera()
+            self._send_report_mode(self.REPORT_MODES[(wiimote.accelerometer.is_active(), ir_mode)])
+
+    def add_decoder(self, decoder):
+        """
+        Registers a sensor object for the reports listed in its SUPPORTED_REPORTS.
+        Its handle_report(report, timestamp) is called for these reports
+        (without the 0xa1 header byte) while its is_active() returns True.
+        """
+        self._decoders.append(decoder)
+        self.update_dispatch()
+
+    def update_dispatch(self):
+        """
+        Rebuilds the report ID -> decoders table. Needs to be called when
+        the set of active decoders may have changed.
+        """
+        with self._mode_lock:
+            dispatch = [()] * 256
+            for decoder in self._decoders:
+                if not decoder.is_active():
+                    continue
+                for rpt in decoder.SUPPORTED_REPORTS:
+                    dispatch[rpt] += (decoder.handle_report,)
+            self._dispatch = dispatch
+            self.select_report_mode()
+
+    def start_capture(self, path):
+        """
+        Start appending every received report to the capture file at `path`.
+        """
+        self.stop_capture()
+        self._capture = ReportCapture(path)
+        return self._capture
 
-    def set_report_mode(self, mode):
-        self.reporting_mode = mode
-        self._send(0x12, 0x00, mode)
+    def stop_capture(self):
+        capture, self._capture = self._capture, None
+        if capture is not None:
+            capture.close()
 
-    def _handle(self, bytes_read):
-        _debug("received " + str(bytes_read))
+    def _handle(self, bytes_read, timestamp=None):
+        """
+        Passes a received report to the sensors.
+        `bytes_read` may be a memoryview of the receive buffer, which is
+        only valid until _handle() returns.
+        """
+        if DEBUG:
+            _debug("received " + str(bytes(bytes_read)))
         # assert(bytes_read[0] == self._CMD_SET_REPORT + 1)
-        rpt_type = bytes_read[1]
-        # all reports include button data
-        self.wiimote.buttons.handle_report(bytes_read[1:])
-        if rpt_type in Accelerometer.SUPPORTED_REPORTS:
-            self.wiimote.accelerometer.handle_report(bytes_read[1:])
-        if rpt_type in Memory.SUPPORTED_REPORTS:
-            self.wiimote.memory.handle_report(bytes_read[1:])
-        if rpt_type in IRCam.SUPPORTED_REPORTS:
-            self.wiimote.ir.handle_report(bytes_read[1:])
+        capture = self._capture
+        if capture is not None:
+            capture.write(bytes_read)
+        if timestamp is None:
+            timestamp = time.monotonic()
+        rpt = bytes_read[1]
+        stats = self.stats
+        stats.reports[rpt] += 1
+        if rpt >= 0x30:
+            count = stats.arrival_count
+            stats.arrivals[count & (ReportStats.HISTORY - 1)] = timestamp
+            stats.arrival_count = count + 1
+        decoders = self._dispatch[rpt]
+        if decoders:
+            report = memoryview(bytes_read)[1:]
+            if self.timing:
+                clock = time.perf_counter_ns
+                for decoder in decoders:
+                    start = clock()
+                    decoder(report, timestamp)
+                    stats.add_decode(decoder, (clock() - start) / 1000)
+            else:
+                for decoder in decoders:
+                    decoder(report, timestamp)
+
+    def send_rumble(self):
+        """
+        Sends the rumble bit in the rumble report.
+        """
+        self._send_report(ReportEncoder.RPT_RUMBLE, (0x00,))
 
     def set_rumble(self, state):
-        self.rumble = state
-        # send any report to toggle rumble bit
-        self._send(self.RPT_STATUS_REQ, int(state))
+        self._writer.set_rumble(self, state)
+        self.send_rumble()
 
 
 class WiiMote(object):
 
     # instance methods
-    def __init__(self, btaddr, model):
+    def __init__(self, btaddr, model, transport=None, manager=None, cache=None):
         self.btaddr = btaddr
         self.model = model
         self.connected = False
-        self._com = CommunicationHandler(self)
+        # LED and rumble timelines and all output reports are handled by the
+        # manager's or by an own scheduler and writer thread
+        self._own_scheduler = manager is None
+        self._scheduler = ActuatorScheduler() if self._own_scheduler else manager.scheduler
+        self._writer = OutputWriter() if self._own_scheduler else manager.writer
+        self._com = CommunicationHandler(self, transport, self._writer)
         self._leds = LEDs(self)
         self.accelerometer = Accelerometer(self)
         self.buttons = Buttons(self)
@@ -685,17 +3812,81 @@ class WiiMote(object):
         self.speaker = Speaker(self)
         self.memory = Memory(self)
         self.ir = IRCam(self)
+        for decoder in (self.buttons, self.accelerometer, self.memory, self.ir):
+            self._com.add_decoder(decoder)
+        self._com.auto_report_mode = True
+        self._com.select_report_mode()
         """
-        Initializations before this point may not read from memory as
-        this would block forever (until the CommunicationHandler is started).
+        Initializations before this point may not use blocking memory reads
+        (Memory.read() raises a RuntimeError until the CommunicationHandler is started).
         CommunicationHandler can not be started earlier because the sensors
         would not yet be assigned to variables
         """
-        self._com.start()
+        if manager is None:
+            self._com.start()
+        else:
+            manager._attach(self)
+        self.accelerometer.load_calibration(cache)
         self.leds[0] = True  # set first LED to signal successful connection.
 
     def disconnect(self):
-        self._com.running = False
+        self._scheduler.remove(self._com)
+        self._writer.remove(self._com)
+        if self._own_scheduler:
+            self._scheduler.stop()
+            self._writer.stop()
+        self._com.stop()
+        for callbacks in self._callback_lists():
+            callbacks.close()
+
+    def start_capture(self, path):
+        """
+        Record all reports received from the Wiimote into the capture file at `path`.
+        Use ReplaySource or ReplayTransport to play it back.
+        """
+        return self._com.start_capture(path)
+
+    def stop_capture(self):
+        self._com.stop_capture()
+
+    def set_timing(self, enabled=True):
+        """
+        Enables measuring decode times per sensor and latency and duration
+        of every callback (off by default, as it costs some CPU time per
+        report). Report counts, intervals, jitter, gaps and queue depths are
+        always recorded.
+        """
+        self._com.timing = enabled
+        for callbacks in self._callback_lists():
+            callbacks.set_timing(enabled)
+
+    def _callback_lists(self):
+        return (self.accelerometer._callbacks, self.buttons._callbacks,
+                self.buttons._event_callbacks, self.buttons._gesture_callbacks,
+                self.ir._callbacks)
+
+    def _subscriptions(self):
+        return [('accelerometer', list(self.accelerometer._callbacks)),
+                ('buttons', list(self.buttons._callbacks) + list(self.buttons._event_callbacks) +
+                 list(self.buttons._gesture_callbacks)),
+                ('ir', list(self.ir._callbacks))]
+
+    def stats(self):
+        """
+        Returns a dict with report counts and rates, the distribution of
+        intervals between data reports, jitter, estimated lost reports,
+        decode times per sensor, per callback latency (report received ->
+        callback called), queue depth and dropped items, and depth, send
+        rate and queueing delay of the output queue.
+        All times are in microseconds; decode and callback times are only
+        measured after set_timing().
+        See MetricsServer for exporting these values to Prometheus.
+        """
+        stats = self._com.stats.as_dict()
+        stats['callbacks'] = dict((sensor, [subscription.stats() for subscription in subscriptions])
+                                  for sensor, subscriptions in self._subscriptions())
+        stats['output'] = self._com.output_stats()
+        return stats
 
     def _get_capabilities(self):
         return None
@@ -723,3 +3914,189 @@ class WiiMote(object):
 
     leds = property(get_leds, set_leds)
     # rumble = property(get_rumble, set_rumble)
+
+
+class _ReceiveThread(threading.Thread):
+    """
+    Services the data channels of many CommunicationHandlers with a single
+    poll() loop. Every ready connection gets one report per loop iteration,
+    so a busy device can not starve the others.
+    """
+
+    def __init__(self, name):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.running = False
+        self._lock = threading.Lock()
+        self._handlers = {}  # fd -> CommunicationHandler
+        self._stats = {}  # fd -> DeviceStats
+        self._added = []
+        self._wakeup_lock = threading.Lock()  # guards closing the wake-up pipe
+        self._wakeup_r, self._wakeup_w = os.pipe()
+
+    def __len__(self):
+        return len(self._handlers) + len(self._added)
+
+    def add(self, handler, stats):
+        handler._receiver = self
+        handler.running = True
+        with self._lock:
+            self._added.append((handler, stats))
+        self.wakeup()
+
+    def wakeup(self):
+        with self._wakeup_lock:
+            if self._wakeup_w is not None:  # thread still running
+                os.write(self._wakeup_w, b'\x00')
+
+    def stop(self):
+        self.running = False
+        self.wakeup()
+
+    def _update(self, poller):
+        """
+        Registers new connections and disposes of closed ones.
+        """
+        with self._lock:
+            added, self._added = self._added, []
+        for handler, stats in added:
+            fd = handler._transport.fileno()
+            self._handlers[fd] = handler
+            self._stats[fd] = stats
+            poller.register(fd, select.POLLIN)
+        for fd, handler in list(self._handlers.items()):
+            if not handler.running:
+                poller.unregister(fd)
+                del self._handlers[fd]
+                del self._stats[fd]
+                handler._dispose()
+
+    def run(self):
+        self.running = True
+        poller = select.poll()
+        poller.register(self._wakeup_r, select.POLLIN)
+        clock = time.perf_counter_ns
+        while self.running:
+            closed = False
+            for fd, event in poller.poll():
+                if fd == self._wakeup_r:
+                    os.read(self._wakeup_r, 64)
+                    closed = True
+                    continue
+                handler = self._handlers.get(fd)
+                if handler is None:
+                    continue
+                start = clock()
+                if not handler._receive():
+                    closed = True
+                    continue
+                self._stats[fd].add(clock() - start)
+            if closed:
+                self._update(poller)
+        for handler in self._handlers.values():
+            handler.running = False
+            handler._dispose()
+        with self._wakeup_lock:
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self._wakeup_r = self._wakeup_w = None
+
+
+class DeviceStats(object):
+    """
+    Report counts and processing times of one device handled by a WiimoteManager.
+    """
+
+    def __init__(self, btaddr):
+        self.btaddr = btaddr
+        self.reports = 0
+        self.handle_ns = 0
+        self.max_handle_ns = 0
+        self.started = time.monotonic()
+
+    def add(self, handle_ns):
+        self.reports += 1
+        self.handle_ns += handle_ns
+        if handle_ns > self.max_handle_ns:
+            self.max_handle_ns = handle_ns
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {'reports': self.reports,
+                'reports_per_s': self.reports / elapsed if elapsed > 0 else 0.0,
+                'mean_handle_us': self.handle_ns / self.reports / 1000 if self.reports else 0.0,
+                'max_handle_us': self.max_handle_ns / 1000}
+
+
+class WiimoteManager(object):
+    """
+    Connects to many Wiimotes and receives the reports of all of them in
+    a small, fixed number of threads (one by default) instead of one
+    thread per device.
+
+    Example:
+        manager = WiimoteManager()
+        wiimotes = manager.connect_many(wiimote.find())
+        print(manager.stats())
+    """
+
+    def __init__(self, threads=1):
+        self._threads = [_ReceiveThread("WiimoteManager-%d" % i) for i in range(threads)]
+        for thread in self._threads:
+            thread.start()
+        self._stats = {}
+        self.scheduler = ActuatorScheduler()  # LED and rumble timelines of all devices
+        self.writer = OutputWriter()  # output reports of all devices
+        self.wiimotes = []
+
+    def _attach(self, wm):
+        """
+        Called by WiiMote.__init__(): hands the connection to the least busy thread.
+        Transports that can not be polled (e.g. a ReplayTransport) get a
+        receive thread of their own and are not included in stats().
+        """
+        self.wiimotes.append(wm)
+        try:
+            wm._com._transport.fileno()
+        except NotImplementedError:
+            wm._com.start()
+            return
+        stats = DeviceStats(wm.btaddr)
+        self._stats[wm.btaddr] = stats
+        min(self._threads, key=len).add(wm._com, stats)
+
+    def connect(self, btaddr, model=None, transport=None):
+        """
+        Connects to a single Wiimote, see wiimote.connect().
+        """
+        return connect(btaddr, model, transport, manager=self)
+
+    def connect_many(self, devices, max_workers=8):
+        """
+        Connects to several Wiimotes concurrently.
+        `devices` is a list of btaddr strings or of (btaddr, model) or
+        (btaddr, model, transport) tuples, e.g. the output of find().
+        Returns the list of WiiMote objects in the same order.
+        """
+        devices = [(device,) if isinstance(device, str) else tuple(device) for device in devices]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self.connect, *device) for device in devices]
+            return [future.result() for future in futures]
+
+    def stats(self):
+        """
+        Returns a dict btaddr -> report count, rate and processing times.
+        """
+        return dict((btaddr, stats.as_dict()) for btaddr, stats in self._stats.items())
+
+    def close(self):
+        """
+        Disconnects all Wiimotes and stops the receive threads.
+        """
+        self.scheduler.stop()
+        self.writer.stop()
+        for thread in self._threads:
+            thread.stop()
+        for thread in self._threads:
+            thread.join()
+        self.wiimotes = []
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Headless benchmarks for the report ingest, callback, output and flowchart paths.
+No Bluetooth hardware is needed: synthetic reports are generated with
+wiimote_emulator.VirtualWiimote and fed directly into the code under test.
+
+Usage:
+    python3 wiimote_bench.py                     # run all benchmarks
+    python3 wiimote_bench.py -k fanout           # only benchmarks matching 'fanout'
+    python3 wiimote_bench.py --save base.json    # store results as baseline
+    python3 wiimote_bench.py --compare base.json # fail on regressions
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+import wiimote
+import wiimote_emulator
+
+
+class NullTransport(wiimote.Transport):
+    """
+    Transport that discards output reports and never delivers input reports,
+    so the CommunicationHandler thread stays idle during benchmarks.
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self._closed = threading.Event()
+
+    def send(self, data):
+        self.sent += 1
+
+    def recv(self, bufsize):
+        self._closed.wait()
+        return b''
+
+    def recv_into(self, buffer, nbytes=0):
+        self._closed.wait()
+        return 0
+
+    def settimeout(self, timeout):
+        pass
+
+    def close(self):
+        self._closed.set()
+
+
+def synthetic_reports(mode, count=1000):
+    """
+    Returns `count` input reports (including header byte) in reporting mode `mode`.
+    """
+    device = wiimote_emulator.VirtualWiimote(None)
+    device.report_mode = mode
+    device.ir_enabled = True
+    return [device.input_report(i / 100.0) for i in range(count)]
+
+
+def offline_wiimote():
+    """
+    Returns a WiiMote object that is not connected to any device.
+    """
+    return wiimote.WiiMote("00:00:00:00:00:00", wiimote.KNOWN_DEVICES[1], NullTransport())
+
+
+def measure(func, args_list, repeat=3):
+    """
+    Calls func(*args) for every entry of args_list and returns a dict with
+    throughput (calls/s), p50/p99 latency (us), the net number of memory
+    blocks that stay allocated per call and the transient memory per call
+    (tracemalloc peak).
+    """
+    n = len(args_list)
+    for args in args_list[:min(n, 100)]:  # warm up
+        func(*args)
+    latencies = np.empty(n * repeat, dtype=np.int64)
+    clock = time.perf_counter_ns
+    blocks_before = sys.getallocatedblocks()
+    start = clock()
+    i = 0
+    for _ in range(repeat):
+        for args in args_list:
+            t0 = clock()
+            func(*args)
+            latencies[i] = clock() - t0
+            i += 1
+    elapsed = (clock() - start) / 1e9
+    blocks = (sys.getallocatedblocks() - blocks_before) / (n * repeat)
+    tracemalloc.start()
+    transient = 0
+    for args in args_list:
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        func(*args)
+        transient += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return {'throughput': n * repeat / elapsed,
+            'p50_us': float(np.percentile(latencies, 50)) / 1000,
+            'p99_us': float(np.percentile(latencies, 99)) / 1000,
+            'blocks_per_call': blocks,
+            'bytes_per_call': transient / n}
+
+
+# ----- benchmarks ----------------------------------------------------------
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+@benchmark
+def handle_buttons():
+    wm = offline_wiimote()
+    reports = synthetic_reports(0x30)
+    return measure(wm._com._handle, [(r,) for r in reports])
+
+
+@benchmark
+def handle_acc():
+    wm = offline_wiimote()
+    reports = synthetic_reports(0x31)
+    return measure(wm._com._handle, [(r,) for r in reports])
+
+
+@benchmark
+def handle_acc_ir():
+    wm = offline_wiimote()
+    wm.ir.set_enabled(True)
+    reports = synthetic_reports(0x33)
+    return measure(wm._com._handle, [(r,) for r in reports])
+
+
+@benchmark
+def handle_acc_ir_full():
+    wm = offline_wiimote()
+    wm.ir.set_enabled(True)
+    reports = synthetic_reports(0x3e)
+    return measure(wm._com._handle, [(r,) for r in reports])
+
+
+def _fanout(subscribers):
+    def run():
+        wm = offline_wiimote()
+        for _ in range(subscribers):
+            wm.accelerometer.register_callback(lambda state: None)
+        reports = synthetic_reports(0x31)
+        return measure(wm._com._handle, [(r,) for r in reports])
+    run.__name__ = 'fanout_%d' % subscribers
+    return run
+
+for _subscribers in (1, 4, 16, 64):
+    benchmark(_fanout(_subscribers))
+
+
+@benchmark
+def send_leds():
+    wm = offline_wiimote()
+    return measure(wm._com.send_leds, [(0x10 << (i % 4),) for i in range(1000)])
+
+
+@benchmark
+def send_speaker_data():
+    wm = offline_wiimote()
+    samples = bytes(range(20))
+    return measure(wm._com.send_speaker_data, [(samples,)] * 1000)
+
+
+@benchmark
+def decode_batch():
+    reports = [r[1:] for r in synthetic_reports(0x33, 10000)]
+    buf = b''.join(r.ljust(wiimote.REPORT_LENGTH, b'\x00') for r in reports)
+    result = measure(wiimote.decode_reports, [(buf,)] * 10)
+    # report per-report numbers
+    for key in ('throughput',):
+        result[key] *= len(reports)
+    for key in ('p50_us', 'p99_us', 'blocks_per_call', 'bytes_per_call'):
+        result[key] /= len(reports)
+    return result
+
+
+def _qt_app():
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    import pyqtgraph as pg
+    return pg.mkQApp()
+
+
+def _acc_kwds(count=1000):
+    values = np.random.randint(0, 1024, size=(count, 3))
+    return [{'accelXIn': np.array([x]), 'accelYIn': np.array([y]), 'accelZIn': np.array([z])}
+            for x, y, z in values]
+
+
+@benchmark
+def buffer_node():
+    _qt_app()
+    import wiimote_node
+    node = wiimote_node.BufferNode('Buffer')
+    node.ctrls['size'].setValue(1024)
+    samples = [{'dataIn': np.array([v])} for v in np.random.randint(0, 1024, 5000)]
+    return measure(lambda kwds: node.process(**kwds), [(kwds,) for kwds in samples])
+
+
+@benchmark
+def normal_vector_node():
+    _qt_app()
+    import analyze
+    node = analyze.NormalVectorNode('NormalVector')
+    return measure(lambda kwds: node.process(**kwds), [(kwds,) for kwds in _acc_kwds()])
+
+
+@benchmark
+def log_node():
+    _qt_app()
+    import analyze
+    with contextlib.redirect_stdout(io.StringIO()):
+        node = analyze.LogNode('Logging')
+    devnull = open(os.devnull, 'w')
+
+    def process(kwds):
+        with contextlib.redirect_stdout(devnull):
+            node.process(**kwds)
+    try:
+        return measure(process, [(kwds,) for kwds in _acc_kwds()])
+    finally:
+        devnull.close()
+
+
+# ----- reporting -----------------------------------------------------------
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of (name, message) tuples for every benchmark whose
+    throughput dropped or whose p99 latency rose by more than `tolerance`.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append((name, "throughput %.0f/s -> %.0f/s" %
+                                (base['throughput'], result['throughput'])))
+        if result['p99_us'] > base['p99_us'] * (1 + tolerance):
+            regressions.append((name, "p99 %.2f us -> %.2f us" % (base['p99_us'], result['p99_us'])))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-k', dest='pattern', default='', help="only run benchmarks containing PATTERN")
+    parser.add_argument('--save', metavar='FILE', help="save results as JSON baseline")
+    parser.add_argument('--compare', metavar='FILE', help="compare against a JSON baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed relative regression (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    results = {}
+    print("%-20s %14s %10s %10s %12s %12s" %
+          ("benchmark", "calls/s", "p50 us", "p99 us", "blocks/call", "bytes/call"))
+    for func in BENCHMARKS:
+        if args.pattern not in func.__name__:
+            continue
+        try:
+            result = func()
+        except ImportError as e:
+            print("%-20s skipped (%s)" % (func.__name__, e))
+            continue
+        results[func.__name__] = result
+        print("%-20s %14.0f %10.2f %10.2f %12.2f %12.1f" %
+              (func.__name__, result['throughput'], result['p50_us'], result['p99_us'],
+               result['blocks_per_call'], result['bytes_per_call']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, message in regressions:
+            print("REGRESSION %s: %s" % (name, message))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
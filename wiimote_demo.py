@@ -15,7 +15,7 @@ input("Press the 'sync' button on the back of your Wiimote Plus " +
       "Press <return> once the Wiimote's LEDs start blinking.")
 
 if len(sys.argv) == 1:
-    addr, name = wiimote.find()[0]
+    addr, name = next(wiimote.find_iter())
 elif len(sys.argv) == 2:
     addr = sys.argv[1]
     name = None
@@ -32,19 +32,13 @@ patterns = [[1, 0, 0, 0],
             [0, 0, 1, 0],
             [0, 1, 0, 0],
             [1, 0, 0, 0]]
-for i in range(5):
-    for p in patterns:
-        wm.leds = p
-        time.sleep(0.05)
+wm.leds.animate(patterns, interval=0.05, repeat=5).wait()
 
 
 
-def print_ir(ir_data):
-    if len(ir_data) == 0:
-        return
-    for ir_obj in ir_data:
-        # print("%4d %4d %2d     " % (ir_obj["x"],ir_obj["y"],ir_obj["size"]), end=' ')
-        print("%4d %4d %2d     " % (ir_obj["x"], ir_obj["y"], ir_obj["size"]))
+def print_ir(ir_frame):
+    for x, y, size in ir_frame[ir_frame[:, wiimote.IRCam.VALID] != 0, :3]:
+        print("%4d %4d %2d     " % (x, y, size))
     print()
 
 #wm.ir.register_callback(print_ir)
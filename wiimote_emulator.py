@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Protocol-level Wiimote emulator for wiimote.py
+#
+# Emulates the report protocol described at http://wiibrew.org/wiki/Wiimote
+# on top of local sockets, so that the whole stack can be exercised and
+# benchmarked without Bluetooth hardware.
+
+import math
+import select
+import socket
+import threading
+import time
+
+import wiimote
+
+
+class EmulatedTransport(wiimote.Transport):
+    """
+    Host side of a connection to a VirtualWiimote.
+    Uses a SOCK_SEQPACKET socketpair, which keeps report boundaries
+    just like an L2CAP channel.
+    """
+
+    CMD_SET_REPORT = 0xa2
+
+    def __init__(self, device, sock):
+        self.device = device
+        self._socket = sock
+
+    def send(self, data):
+        self._socket.send(data)
+
+    def recv(self, bufsize):
+        return self._socket.recv(bufsize)
+
+    def recv_into(self, buffer, nbytes=0):
+        return self._socket.recv_into(buffer, nbytes)
+
+    def settimeout(self, timeout):
+        self._socket.settimeout(timeout)
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def close(self):
+        self._socket.close()
+
+
+class VirtualWiimote(threading.Thread):
+    """
+    A virtual Wiimote that answers output reports like the real device and
+    streams input reports in the current data reporting mode at `rate` Hz.
+
+    Supported output reports: rumble (0x10), LEDs (0x11), report mode (0x12),
+    IR enable (0x13, 0x1a), status request (0x15), memory write (0x16) and
+    read (0x17), speaker (0x14, 0x18, 0x19).
+    Memory reads are answered with 0x21 reports, writes and other commands
+    that request an acknowledgement with 0x22 reports.
+    """
+
+    RPT_STATUS = 0x20
+    RPT_READ_DATA = 0x21
+    RPT_ACK = 0x22
+
+    EEPROM_SIZE = 0x1700
+
+    # data reporting mode -> number of payload bytes after the button bytes
+    REPORT_PAYLOAD = {0x30: 0, 0x31: 3, 0x33: 15, 0x35: 19, 0x36: 19, 0x37: 19, 0x3e: 19, 0x3f: 19}
+
+    def __init__(self, sock, rate=100.0, model='Nintendo RVL-CNT-01-TR'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.model = model
+        self.rate = rate
+        self.report_mode = 0x30
+        self._second_half = False  # next interleaved report is 0x3f
+        self.continuous = False
+        self.leds = 0x00
+        self.ir_enabled = False
+        self.rumble = False
+        self.buttons = 0x0000
+        self.eeprom = bytearray(self.EEPROM_SIZE)
+        self.registers = {}
+        self.reports_sent = 0
+        self.reports_received = 0
+        self.speaker_reports = 0
+        self.running = False
+        self._socket = sock
+        # default accelerometer calibration: zero point 0x80, 1g at 0x9a,
+        # an unused byte and a checksum over the first nine bytes
+        calibration = [0x80, 0x80, 0x80, 0x00, 0x9a, 0x9a, 0x9a, 0x00, 0x00]
+        calibration.append((sum(calibration) + 0x55) & 0xff)
+        self.eeprom[0x16:0x16 + len(calibration)] = bytes(calibration)
+        self.eeprom[0x20:0x20 + len(calibration)] = bytes(calibration)
+
+    # ----- sensor model ---------------------------------------------------
+
+    def acceleration(self, t):
+        """
+        Returns raw (x, y, z) accelerometer values for time `t`.
+        Override for other motion patterns.
+        """
+        x = 0x200 + int(100 * math.sin(2 * math.pi * t))
+        y = 0x200 + int(100 * math.cos(2 * math.pi * t))
+        z = 0x268
+        return x, y, z
+
+    def ir_blobs(self, t):
+        """
+        Returns up to four (x, y, size) tuples for time `t`.
+        Override for other IR patterns.
+        """
+        x = 512 + int(300 * math.sin(t))
+        y = 384 + int(200 * math.cos(t))
+        return [(x, y, 3), (x + 100, y, 3)]
+
+    def press(self, button_mask):
+        """
+        Set the currently pressed buttons (a Buttons.BUTTONS bitmask).
+        """
+        self.buttons = button_mask
+
+    # ----- report encoding ------------------------------------------------
+
+    def _button_bytes(self):
+        return [(self.buttons >> 8) & 0xff, self.buttons & 0xff]
+
+    def _accel_bytes(self, t, btn):
+        x, y, z = self.acceleration(t)
+        btn[0] |= (x & 0b11) << 5
+        btn[1] |= ((y & 0b10) << 4) | ((z & 0b10) << 5)
+        return [x >> 2, y >> 2, z >> 2]
+
+    def _visible_blobs(self, t):
+        return self.ir_blobs(t)[:4] if self.ir_enabled else []
+
+    def _ir_extended(self, t):
+        data = []
+        blobs = self._visible_blobs(t)
+        for x, y, size in blobs:
+            data += [x & 0xff, y & 0xff, ((y >> 8) << 6) | ((x >> 8) << 4) | (size & 0x0f)]
+        return data + [0xff] * (12 - len(data))
+
+    def _ir_basic(self, t):
+        blobs = self._visible_blobs(t)
+        blobs += [(0x3ff, 0x3ff, 0)] * (4 - len(blobs))
+        data = []
+        for (x1, y1, _), (x2, y2, _) in (blobs[0:2], blobs[2:4]):
+            data += [x1 & 0xff, y1 & 0xff,
+                     ((y1 >> 8) << 6) | ((x1 >> 8) << 4) | ((y2 >> 8) << 2) | (x2 >> 8),
+                     x2 & 0xff, y2 & 0xff]
+        return data
+
+    def _ir_full(self, t, first_slot):
+        blobs = self._visible_blobs(t)
+        blobs += [None] * (4 - len(blobs))
+        data = []
+        for blob in blobs[first_slot:first_slot + 2]:
+            if blob is None:
+                data += [0xff] * 9
+                continue
+            x, y, size = blob
+            bbox = [max(x - 4 * size, 0) >> 3, max(y - 4 * size, 0) >> 3,
+                    min(x + 4 * size, 1023) >> 3, min(y + 4 * size, 767) >> 3]
+            data += [x & 0xff, y & 0xff, ((y >> 8) << 6) | ((x >> 8) << 4) | (size & 0x0f)]
+            data += bbox + [0x00, min(size * 16, 0xff)]
+        return data
+
+    def _interleaved_report(self, t, btn):
+        x, y, z = (value >> 2 for value in self.acceleration(t))  # 8 bit precision
+        if self._second_half:
+            rpt, acc, z_bits, first_slot = 0x3f, y, z & 0x0f, 2
+        else:
+            rpt, acc, z_bits, first_slot = 0x3e, x, z >> 4, 0
+        self._second_half = not self._second_half
+        btn[0] |= (z_bits & 0b11) << 5
+        btn[1] |= (z_bits >> 2) << 5
+        return bytes([0xa1, rpt] + btn + [acc] + self._ir_full(t, first_slot))
+
+    def input_report(self, t):
+        """
+        Returns the input report (including header byte) for time `t`
+        in the current data reporting mode.
+        In the interleaved modes 0x3e/0x3f, successive calls alternate
+        between both halves.
+        """
+        mode = self.report_mode
+        btn = self._button_bytes()
+        if mode in (0x3e, 0x3f):
+            return self._interleaved_report(t, btn)
+        if mode in (0x31, 0x33, 0x35, 0x37):
+            payload = self._accel_bytes(t, btn)
+        else:
+            payload = []
+        if mode == 0x33:
+            payload += self._ir_extended(t)
+        elif mode == 0x36:
+            payload += self._ir_basic(t) + [0x00] * 9
+        elif mode == 0x37:
+            payload += self._ir_basic(t) + [0x00] * 6
+        payload += [0x00] * (self.REPORT_PAYLOAD.get(mode, 0) - len(payload))
+        return bytes([0xa1, mode] + btn + payload)
+
+    def _send_report(self, report):
+        try:
+            self._socket.send(report)
+            self.reports_sent += 1
+        except OSError:
+            self.running = False
+
+    # ----- output report handling -----------------------------------------
+
+    def _read_memory(self, space, address, size):
+        if space & 0x04:
+            return bytes(self.registers.get(address + i, 0) for i in range(size)), 0
+        if address + size > self.EEPROM_SIZE:
+            return b'', 8
+        return bytes(self.eeprom[address:address + size]), 0
+
+    def _write_memory(self, space, address, data):
+        if space & 0x04:
+            for i, b in enumerate(data):
+                self.registers[address + i] = b
+            return 0
+        if address + len(data) > self.EEPROM_SIZE:
+            return 8
+        self.eeprom[address:address + len(data)] = data
+        return 0
+
+    def _ack(self, rpt, error=0):
+        self._send_report(bytes([0xa1, self.RPT_ACK] + self._button_bytes() + [rpt, error]))
+
+    def handle_output_report(self, data):
+        """
+        Process one output report as sent by the host (including header byte).
+        """
+        self.reports_received += 1
+        rpt, payload = data[1], data[2:]
+        if not payload:
+            return
+        self.rumble = bool(payload[0] & 0x01)
+        if rpt == 0x11:
+            self.leds = payload[0] & 0xf0
+        elif rpt == 0x13:
+            self.ir_enabled = bool(payload[0] & 0x04)
+            if payload[0] & 0x02:
+                self._ack(rpt)
+        elif rpt == 0x12:
+            self.continuous = bool(payload[0] & 0x04)
+            self.report_mode = payload[1]
+            self._second_half = False
+        elif rpt == 0x15:
+            flags = self.leds | 0x02  # LEDs + speaker enabled
+            self._send_report(bytes([0xa1, self.RPT_STATUS] + self._button_bytes() +
+                                    [flags, 0x00, 0x00, 0xc0]))
+        elif rpt == 0x16:
+            address = (payload[1] << 16) | (payload[2] << 8) | payload[3]
+            size = payload[4]
+            error = self._write_memory(payload[0], address, bytes(payload[5:5 + size]))
+            self._ack(rpt, error)
+        elif rpt == 0x17:
+            address = (payload[1] << 16) | (payload[2] << 8) | payload[3]
+            size = (payload[4] << 8) | payload[5]
+            data, error = self._read_memory(payload[0], address, size)
+            self._send_read_replies(address, data, error)
+        elif rpt == 0x18:
+            self.speaker_reports += 1
+        elif rpt in (0x14, 0x19, 0x1a) and payload[0] & 0x02:
+            self._ack(rpt)
+
+    def _send_read_replies(self, address, data, error):
+        btn = self._button_bytes()
+        if error:
+            self._send_report(bytes([0xa1, self.RPT_READ_DATA] + btn +
+                                    [0xf0 | error, (address >> 8) & 0xff, address & 0xff] +
+                                    [0x00] * 16))
+            return
+        for offset in range(0, len(data), 16):
+            chunk = data[offset:offset + 16]
+            chunk_address = address + offset
+            self._send_report(bytes([0xa1, self.RPT_READ_DATA] + btn +
+                                    [(len(chunk) - 1) << 4,
+                                     (chunk_address >> 8) & 0xff, chunk_address & 0xff]) +
+                              chunk.ljust(16, b'\x00'))
+
+    # ----- main loop ------------------------------------------------------
+
+    def run(self):
+        self.running = True
+        start = time.monotonic()
+        next_report = start
+        last_report = None
+        while self.running:
+            timeout = max(next_report - time.monotonic(), 0)
+            readable, _, _ = select.select([self._socket], [], [], timeout)
+            if readable:
+                try:
+                    data = self._socket.recv(32)
+                except OSError:
+                    break
+                if not data:  # host closed the connection
+                    break
+                self.handle_output_report(data)
+                continue
+            now = time.monotonic()
+            # catch up if we fell behind, e.g. at rates of several kHz
+            while next_report <= now and self.running:
+                report = self.input_report(next_report - start)
+                # without the continuous flag, only changed data is reported
+                if self.continuous or report != last_report:
+                    self._send_report(report)
+                    last_report = report
+                next_report += 1.0 / self.rate
+        self.running = False
+        self._socket.close()
+
+    def stop(self):
+        self.running = False
+
+
+def create_transport(rate=100.0, model='Nintendo RVL-CNT-01-TR', device_class=VirtualWiimote):
+    """
+    Starts a new virtual Wiimote and returns an EmulatedTransport connected to it.
+    The device is available as `transport.device`.
+    """
+    host_socket, device_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    device = device_class(device_socket, rate=rate, model=model)
+    device.start()
+    return EmulatedTransport(device, host_socket)
+
+
+def connect(rate=100.0, model='Nintendo RVL-CNT-01-TR', btaddr=None, device_class=VirtualWiimote,
+            manager=None):
+    """
+    Returns a wiimote.WiiMote object connected to a new virtual Wiimote.
+    If a wiimote.WiimoteManager is given, it receives the device's reports.
+    """
+    transport = create_transport(rate, model, device_class)
+    if btaddr is None:
+        btaddr = "00:00:00:00:%02X:%02X" % ((id(transport) >> 8) & 0xff, id(transport) & 0xff)
+    return wiimote.WiiMote(btaddr, model, transport, manager)
+
+
+def connect_many(count, rate=100.0, model='Nintendo RVL-CNT-01-TR', manager=None):
+    """
+    Returns a list of `count` WiiMote objects, each connected to its own virtual Wiimote.
+    """
+    return [connect(rate, model, btaddr="00:00:00:00:%02X:%02X" % (i >> 8, i & 0xff), manager=manager)
+            for i in range(count)]
+
+
+if __name__ == '__main__':
+    import sys
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 100.0
+    wm = connect(rate)
+    reader = wm.accelerometer.reader()
+    while True:
+        time.sleep(1)
+        timestamps, samples = reader.read()
+        print("%d samples/s, last: %s" % (len(samples), wm.accelerometer))
@@ -20,6 +20,7 @@ class BopItWiiWidget(QtWidgets.QWidget):
     """
 
     BUTTONS = ["A", "One", "Two", "B"]
+    SHAKE_THRESHOLD = 2.3  # g on any axis
 
     def __init__(self, wiimote):
         super(BopItWiiWidget, self).__init__(None)
@@ -154,7 +155,7 @@ class BopItWiiWidget(QtWidgets.QWidget):
 
     ''' Acceleration values changed in the wiimote'''
     def wiiMoveEventReceived(self, acc_data):
-        if acc_data[0] > 750 or acc_data[1] > 750 or acc_data[2] > 750:
+        if self.wiimote.accelerometer.to_g(acc_data).max() > self.SHAKE_THRESHOLD:
             self.inputHandler.accInputReceived.disconnect()
             self.registerInput("Shake")
             time.sleep(0.2)
@@ -259,7 +260,7 @@ def init_wiimote():
     )
 
     if len(sys.argv) == 1:
-        addr, name = wiimote.find()[0]
+        addr, name = next(wiimote.find_iter())
     elif len(sys.argv) == 2:
         addr = sys.argv[1]
         name = None
@@ -16,12 +16,17 @@ class BufferNode(CtrlNode):
     """
     Buffers the last n samples provided on input and provides them as a list of
     length n on output.
+    Input may be a single sample or an array of samples.
     A spinbox widget allows for setting the size of the buffer.
     Default size is 32 samples.
+    Samples are kept in a ring buffer, so adding samples does not copy the
+    buffer. The output is a read-only view into the buffer unless the
+    "copy" checkbox is set.
     """
     nodeName = "Buffer"
     uiTemplate = [
-        ('size',  'spin', {'value': 32.0, 'step': 1.0, 'bounds': [0.0, 128.0]}),
+        ('size',  'spin', {'value': 32.0, 'step': 1.0, 'bounds': [1.0, 10000000.0]}),
+        ('copy', 'check', {'checked': False}),
     ]
 
     def __init__(self, name):
@@ -29,14 +34,29 @@ class BufferNode(CtrlNode):
             'dataIn': dict(io='in'),
             'dataOut': dict(io='out'),
         }
-        self._buffer = np.array([])
+        self._buffer = wiimote.SampleBuffer((), capacity=32, dtype=np.float64)
         CtrlNode.__init__(self, name, terminals=terminals)
 
+    def _resize(self, size):
+        """
+        Replaces the ring buffer with one of capacity `size`, keeping the newest samples.
+        """
+        _, samples = self._buffer.latest(min(size, len(self._buffer)))
+        self._buffer = wiimote.SampleBuffer((), capacity=size, dtype=np.float64)
+        self._buffer.extend(samples)
+
     def process(self, **kwds):
         size = int(self.ctrls['size'].value())
-        self._buffer = np.append(self._buffer, kwds['dataIn'])
-        self._buffer = self._buffer[-size:]
-        output = self._buffer
+        if size != self._buffer.capacity:
+            self._resize(size)
+        if kwds['dataIn'] is not None:
+            self._buffer.extend(np.atleast_1d(kwds['dataIn']))
+        _, output = self._buffer.latest(len(self._buffer))
+        if self.ctrls['copy'].isChecked():
+            output = output.copy()
+        else:
+            output = output.view()
+            output.flags.writeable = False
         return {'dataOut': output}
 
 fclib.registerNodeType(BufferNode, [('Data',)])
@@ -46,12 +66,18 @@ class WiimoteNode(Node):
     """
     Outputs sensor data from a Wiimote.
 
-    Supported sensors: accelerometer (3 axis)
+    Supported sensors: accelerometer (3 axis, raw values and calibration)
     Text input box allows for setting a Bluetooth MAC address.
     Pressing the "connect" button tries connecting to the Wiimote.
-    Update rate can be changed via a spinbox widget. Setting it to "0"
-    activates callbacks every time a new sensor value arrives (which is
-    quite often -> performance hit)
+    Two independent settings control the output:
+    The update rate spinbox sets how often the flowchart is evaluated.
+    Setting it to "0" evaluates it every time a new sensor value arrives
+    (which is quite often -> performance hit; evaluations that can not
+    keep up are merged).
+    If "all samples" is checked, each evaluation outputs every sample
+    received since the previous one, otherwise only the latest sample.
+    The receive times (time.monotonic()) of the output samples are
+    provided on the 'timestamps' terminal.
     """
 
     nodeName = "Wiimote"
@@ -61,9 +87,11 @@ class WiimoteNode(Node):
             'accelX': dict(io='out'),
             'accelY': dict(io='out'),
             'accelZ': dict(io='out'),
+            'timestamps': dict(io='out'),
+            'calibration': dict(io='out'),
         }
         self.wiimote = None
-        self._acc_vals = []
+        self._reader = None  # SampleReader while all samples are output
 
         # Configuration UI
         self.ui = QtGui.QWidget()
@@ -87,6 +115,11 @@ class WiimoteNode(Node):
         self.update_rate_input.valueChanged.connect(self.set_update_rate)
         self.layout.addWidget(self.update_rate_input)
 
+        self.all_samples_input = QtGui.QCheckBox("all samples")
+        self.all_samples_input.setChecked(True)
+        self.all_samples_input.toggled.connect(self.set_all_samples)
+        self.layout.addWidget(self.all_samples_input)
+
         self.connect_button = QtGui.QPushButton("connect")
         self.connect_button.clicked.connect(self.connect_wiimote)
         self.layout.addWidget(self.connect_button)
@@ -102,12 +135,10 @@ class WiimoteNode(Node):
     def update_all_sensors(self):
         if self.wiimote is None:
             return
-        self._acc_vals = self.wiimote.accelerometer
         # todo: other sensors...
         self.update()
 
     def update_accel(self, acc_vals):
-        self._acc_vals = acc_vals
         self.update()
 
     def ctrlWidget(self):
@@ -116,6 +147,9 @@ class WiimoteNode(Node):
     def connect_wiimote(self):
         self.btaddr = str(self.text.text()).strip()
         if self.wiimote is not None:
+            self.update_timer.stop()
+            self._reader = None
+            self.wiimote.accelerometer.unregister_callback(self.update_accel)
             self.wiimote.disconnect()
             self.wiimote = None
             self.connect_button.setText("connect")
@@ -127,19 +161,46 @@ class WiimoteNode(Node):
                 self.connect_button.setText("try again")
             else:
                 self.connect_button.setText("disconnect")
+                self.set_all_samples(self.all_samples_input.isChecked())
                 self.set_update_rate(self.update_rate_input.value())
 
     def set_update_rate(self, rate):
+        if self.wiimote is None:
+            return
         if rate == 0:  # use callbacks for max. update rate
             self.update_timer.stop()
-            self.wiimote.accelerometer.register_callback(self.update_accel)
+            self.wiimote.accelerometer.register_callback(self.update_accel,
+                                                         policy=wiimote.Subscription.COALESCE)
         else:
             self.wiimote.accelerometer.unregister_callback(self.update_accel)
-            self.update_timer.start(1000.0/rate)
+            self.update_timer.start(int(1000 / rate))
+
+    def set_all_samples(self, enabled):
+        """
+        Switches between outputting all samples received since the last
+        evaluation and only the latest one.
+        """
+        if enabled and self.wiimote is not None:
+            if self._reader is None:
+                self._reader = self.wiimote.accelerometer.reader()
+        else:
+            self._reader = None
 
     def process(self, **kwdargs):
-        x, y, z = self._acc_vals
-        return {'accelX': np.array([x]), 'accelY': np.array([y]), 'accelZ': np.array([z])}
+        if self.wiimote is None:
+            timestamps, samples = np.empty(0), np.empty((0, 3), dtype=np.uint16)
+            calibration = None
+        else:
+            accelerometer = self.wiimote.accelerometer
+            if self._reader is not None:
+                timestamps, samples = self._reader.read()
+            else:
+                timestamps, samples = accelerometer.samples.latest(1)
+            calibration = accelerometer.calibration
+        # copy out of the ring buffer: downstream nodes may keep the arrays
+        x, y, z = samples.T.astype(np.int64)
+        return {'accelX': x, 'accelY': y, 'accelZ': z, 'timestamps': timestamps.copy(),
+                'calibration': calibration}
 
 fclib.registerNodeType(WiimoteNode, [('Sensor',)])
 